@@ -3,11 +3,11 @@ from fastapi.responses import HTMLResponse, PlainTextResponse
 
 from pathlib import Path
 
-from .routes import mangadex, queue_client, queue_worker, admin
+from .routes import mangadex, queue_client, queue_worker, admin, metrics
 
 from .config import config
-from .stats import stats
-from .queue import manager
+from . import stats
+from .queue import manager, client
 
 __version__ = "1.0.3"
 
@@ -45,18 +45,29 @@ app = FastAPI(
 if config["frontend"]["enabled"] is True:
     app.include_router(mangadex.router)
     app.include_router(queue_client.router)
+    stats.flush_thread.start()
 if config["backend"]["enabled"] is True:
     app.include_router(queue_worker.router)
+    manager.restore_tasks()
     manager.scheduler_thread.start()
     manager.cleanup_thread.start()
 if config["admin"]["enabled"] is True:
     app.include_router(admin.router)
+if config.get("metrics", {}).get("enabled") is True:
+    app.include_router(metrics.router)
+
+
+@app.on_event("startup")
+async def startup():
+    if config["frontend"]["enabled"] is True:
+        client.start_heartbeat()
 
 
 @app.on_event("shutdown")
-def shutdown():
+async def shutdown():
     if config["frontend"]["enabled"] is True:
         stats.save()
+        await client.shutdown()
 
 
 @app.get("/", summary="Index", include_in_schema=False)
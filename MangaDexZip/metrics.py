@@ -0,0 +1,156 @@
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800)
+THROUGHPUT_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+
+registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names, values, extra=()):
+    labels = [f'{k}="{_escape(v)}"' for k, v in (*zip(names, values), *extra)]
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class _CounterChild:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def set(self, n):
+        self.value = n
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Metric:
+    """Base of Prometheus metrics, rendered in the text exposition format by `render`.
+
+    Children (one per set of label values) are created on first use, so unused metrics don't report samples.
+    If `fn` is given, it is called on each scrape instead and returns a value, or a {label values: value} dict."""
+    kind = "untyped"
+
+    def __init__(self, name, doc, labels=(), fn=None):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+        self.fn = fn
+        self.children = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name={self.name}, children={len(self.children)})"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self):
+        if self.fn:
+            values = self.fn()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in values.items()]
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {c.value}" for k, c in self.children.copy().items()]
+
+    def render(self):
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, n=1):
+        self.labels().inc(n)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, n):
+        self.labels().set(n)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        lines = []
+        for k, c in self.children.copy().items():
+            with c.lock:
+                counts, total = c.counts.copy(), c.sum
+            acc = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                acc += n
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, k, (('le', bound),))} {acc}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, k)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, k)} {acc}")
+        return lines
+
+
+def render():
+    lines = []
+    for m in registry:
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+
+# Worker
+page_download_seconds = Histogram("mdzip_page_download_seconds", "Time to download a page from MangaDex@Home.")
+page_download_throughput = Histogram("mdzip_page_download_bytes_per_second",
+                                     "Download speed of pages from MangaDex@Home.", buckets=THROUGHPUT_BUCKETS)
+page_download_bytes = Counter("mdzip_page_download_bytes_total", "Bytes downloaded from MangaDex@Home.")
+page_downloads = Counter("mdzip_page_downloads_total", "Pages downloaded from MangaDex@Home, "
+                         "by MangaDex@Home cache status (x-cache header) and outcome.", ("cache", "success"))
+queue_wait_seconds = Histogram("mdzip_queue_wait_seconds", "Time between task creation and its first action.",
+                               buckets=DURATION_BUCKETS)
+action_duration_seconds = Histogram("mdzip_action_duration_seconds", "Time to run an action.", ("action",),
+                                    buckets=DURATION_BUCKETS)
+
+# Frontend
+worker_request_seconds = Histogram("mdzip_worker_request_seconds", "Time to get the response headers of a worker, "
+                                   "by worker and outcome.", ("worker", "outcome"))
+tasks_submitted = Counter("mdzip_tasks_submitted_total", "Tasks submitted to workers, by task type and worker.",
+                          ("type", "worker"))
@@ -0,0 +1,53 @@
+import sys
+import threading
+from collections import Counter
+from os.path import basename
+from time import monotonic, sleep
+
+MAX_DURATION = 60
+MIN_INTERVAL = 0.001
+
+_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+def _collapse(frame, thread_name):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.append(thread_name)
+    return ";".join(reversed(stack))
+
+
+def sample(duration=10, interval=0.01):
+    """Sample the stacks of all other threads every `interval` seconds, for `duration` seconds.
+
+    Returns the samples in the collapsed stack format (`thread;outer;...;inner count` lines, hottest first),
+    which can be turned into a flamegraph by flamegraph.pl, speedscope or inferno.
+    Only one profile can run at a time, `ProfilerBusyError` is raised otherwise."""
+    duration = min(max(duration, 0), MAX_DURATION)
+    interval = max(interval, MIN_INTERVAL)
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+    try:
+        counts = Counter()
+        me = threading.get_ident()
+        names = {}
+        end = monotonic() + duration
+        while monotonic() < end:
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident != me:
+                    counts[_collapse(frame, names.get(ident, str(ident)))] += 1
+            del frames
+            sleep(interval)
+    finally:
+        _lock.release()
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
@@ -1,20 +1,21 @@
 import threading
 import MangaDexPy
-import functools
 from requests import exceptions as rex
 
 from datetime import datetime
+from time import monotonic
 
 from pathlib import Path
 from shutil import rmtree
 from os import listdir
 from zipfile import ZipFile, ZIP_STORED
 
-from time import sleep
-
+from . import metadata
+from .. import metrics
 from ..config import config
 
 TEMP_PATH = config["backend"]["temp_path"]
+_SCHEMAS = {}
 
 
 def _task_path(task):
@@ -26,26 +27,66 @@ def _task_path_raw(task):
 
 
 class ActionBase:
+    __slots__ = ("data",)
+    options = ()
+    # Seconds the action is expected to take, used to estimate the wait until the worker has a history of durations
+    expected_duration = 0
+
     def __init__(self, data=None):
         self.data = data
 
     def run(self, task):
         pass
 
+    def dump(self):
+        return {k: getattr(self, k) for k in self.options}
+
+    @classmethod
+    def fields(cls):
+        return tuple(k for c in reversed(cls.__mro__) for k in getattr(c, "__slots__", ()))
+
+    @classmethod
+    def schema(cls):
+        """Get the (serializable, unserializable) fields of the action class, computed once per class.
+
+        `data` and options are stored in the task journal, so they are always JSON serializable."""
+        if cls not in _SCHEMAS:
+            serializable = ("data",) + tuple(cls.options)
+            _SCHEMAS[cls] = (serializable, tuple(k for k in cls.fields() if k not in serializable))
+        return _SCHEMAS[cls]
+
+    def snapshot(self):
+        serializable, unserializable = self.schema()
+        return {"name": self.__class__.__name__,
+                "data": {k: getattr(self, k) for k in serializable},
+                "unserializable_data": {k: str(getattr(self, k)) for k in unserializable}}
+
 
 class DefaultCleanupAction(ActionBase):
+    __slots__ = ()
+
     def run(self, task):
         rmtree(_task_path(task), ignore_errors=True)
 
 
 class ArchiveContentsZIP(ActionBase):
+    __slots__ = ()
+    expected_duration = 2
+
     def run(self, task):
         task.status = "Archiving contents"
         p = _task_path(task)
         zp = Path(f"{_task_path_raw(task)}/archive.zip")
+        zp_part = Path(f"{_task_path_raw(task)}/archive.zip.part")
 
-        with ZipFile(zp, "w", compression=ZIP_STORED) as zf:
-            self._archive_directory(task, p, zf, ignores=["archive.zip"])
+        # The archive is only renamed once complete: if it exists, the worker stopped while cleaning up
+        if not zp.is_file():
+            with task.span("archive") as span, ZipFile(zp_part, "w", compression=ZIP_STORED) as zf:
+                self._archive_directory(task, p, zf, ignores=["archive.zip.part"])
+            if task.cancelled:
+                return
+            span.bytes = zp_part.stat().st_size
+            zp_part.replace(zp)
 
         task.status = "Cleaning up..."
         self._cleanup_directory(p, ignores=["archive.zip"])
@@ -58,12 +99,14 @@ class ArchiveContentsZIP(ActionBase):
         ignores = ignores or []
         task.status = f"Archiving contents ({arc_path or '/'})"
         for o in listdir(path):
+            if task.cancelled:
+                return
             p = Path(f"{path}/{o}")
             if p.name in ignores:
                 continue
             elif p.is_dir():
                 self._archive_directory(task, p, arc, arc_path=f"/{p.name}")
-            elif p.is_file():
+            elif p.is_file() and p.suffix != ".part":
                 arc.write(p, Path(f"{arc_path}/{p.name}"))
 
     @staticmethod
@@ -80,6 +123,10 @@ class ArchiveContentsZIP(ActionBase):
 
 
 class AddMangaChapters(ActionBase):
+    __slots__ = ("light", "language", "append_titles", "preferred_groups", "groups_substitute", "start", "end")
+    options = ("light", "language", "append_titles", "preferred_groups", "groups_substitute", "start", "end")
+    expected_duration = 5
+
     def __init__(self, data, light=False, language="en",
                  append_titles=False, preferred_groups=None, groups_substitute=True,
                  start=None, end=None):
@@ -97,11 +144,8 @@ class AddMangaChapters(ActionBase):
         task.status = f"Retrieving chapters for manga {self.data}"
 
         try:
-            md = MangaDexPy.Client()
-            md.session.request = functools.partial(md.session.request, timeout=10)
-            md.session.headers["User-Agent"] = "Proxymiity/MangaDexZip"
-            md.session.headers.pop("Authorization")
-            manga = md.get_manga(self.data)
+            with task.span("manga_info", self.data):
+                manga = metadata.get_manga(self.data)
         except MangaDexPy.NoContentError:
             task.failed = True
             task.status = f"Manga {self.data} not found"
@@ -112,13 +156,14 @@ class AddMangaChapters(ActionBase):
             return
 
         try:
-            chaps = manga.get_chapters(params={
-                "contentRating[]": ["safe", "suggestive", "erotica", "pornographic"],
-                "translatedLanguage[]": [self.language],
-                "includeEmptyPages": 0,
-                "includeFuturePublishAt": 0,
-                "includeExternalUrl": 0
-            })
+            with task.span("feed", manga.id):
+                chaps = metadata.get_feed(manga, {
+                    "contentRating[]": ["safe", "suggestive", "erotica", "pornographic"],
+                    "translatedLanguage[]": [self.language],
+                    "includeEmptyPages": 0,
+                    "includeFuturePublishAt": 0,
+                    "includeExternalUrl": 0
+                })
             if not chaps:
                 task.failed = True
                 task.status = f"There are no chapters available for manga {manga.id}"
@@ -132,92 +177,74 @@ class AddMangaChapters(ActionBase):
             task.status = f"MD API Error occurred during chapters fetch for manga {manga.id}"
             return
 
-        if self.preferred_groups:
-            chaps = self.filter_groups(chaps)
-        if self.start:
-            chaps = self.filter_start(chaps)
-        if self.end:
-            chaps = self.filter_end(chaps)
+        if task.cancelled:
+            return
 
+        chaps, volume_dedupe = self.select_chapters(chaps)
         if not chaps:
             task.failed = True
             task.status = f"There are no chapters available for manga {manga.id} matching your filters"
             return
 
-        dedup_none = False
-        dedup_dict = {}
         for chap in chaps:
-            try:
-                chap_key = (chap.volume, float(chap.chapter))
-            except (ValueError, TypeError):
-                chap_key = (chap.volume, chap.chapter or 0)
-                if chap.chapter is None:
-                    dedup_none = True
-            if chap_key not in dedup_dict:
-                dedup_dict[chap_key] = chap
-
-        if dedup_none and len(dedup_dict) > 1:
-            for _, chap in sorted(dedup_dict.items(), key=lambda i: i[0][1]):
-                task.add_action(DownloadChapter(chap.id, data_obj=chap, light=self.light, subfolder=True,
-                                                append_title=self.append_titles,
-                                                volume_dedupe=chap.chapter is None))
-        else:
-            for _, chap in sorted(dedup_dict.items(), key=lambda i: i[0][1]):
-                task.add_action(DownloadChapter(chap.id, data_obj=chap, light=self.light, subfolder=True,
-                                                append_title=self.append_titles))
+            task.add_action(DownloadChapter(chap.id, data_obj=chap, light=self.light, subfolder=True,
+                                            append_title=self.append_titles,
+                                            volume_dedupe=volume_dedupe and chap.chapter is None))
 
         task.add_action(ArchiveContentsZIP())
 
-    def filter_groups(self, chaps):
-        filtered = []
-        chaps_dict = {}
-        for chap in chaps:
-            try:
-                chap_key = (chap.volume, float(chap.chapter))
-            except (ValueError, TypeError):
-                chap_key = (chap.volume, chap.chapter)
-            if chap_key not in chaps_dict:
-                chaps_dict[chap_key] = []
-            chaps_dict[chap_key].append(chap)
-
-        for chap_list in chaps_dict.values():
-            chaps_groups = {chap: [c.id for c in chap.group] for chap in chap_list}
-            for group in self.preferred_groups:
-                for k, v in chaps_groups.items():
-                    if group in v:
-                        filtered.append(k)
-                        break
-                else:
-                    continue
-                break
-            else:
-                if self.groups_substitute:
-                    filtered.append(tuple(chaps_groups.keys())[0])
+    def select_chapters(self, chaps):
+        """Select the chapters to download, sorted by chapter number.
 
-        return filtered
+        Each chapter number is parsed once, and chapters are filtered by range, then by preferred group (the chapter
+        of the first preferred group, or the first chapter if `groups_substitute` is set), then deduplicated by
+        (volume, chapter) keeping the first one.
+        Also returns whether chapters without a number need their volume to tell them apart."""
+        ranks = {}
+        for i, group in enumerate(self.preferred_groups):
+            ranks.setdefault(group, i)
+        no_rank = len(self.preferred_groups)
+        ranged = bool(self.start or self.end)
+        low, high = self.start or float("-inf"), self.end or float("inf")
 
-    def filter_start(self, chaps):
-        filtered = []
+        dedup_none = False
+        selected = {}
+        candidates = {}
         for chap in chaps:
             try:
-                if float(chap.chapter) >= self.start:
-                    filtered.append(chap)
+                num = float(chap.chapter)
             except (ValueError, TypeError):
+                num = None
+            if ranged and (num is None or not low <= num <= high):
                 continue
-        return filtered
-
-    def filter_end(self, chaps):
-        filtered = []
-        for chap in chaps:
-            try:
-                if float(chap.chapter) <= self.end:
-                    filtered.append(chap)
-            except (ValueError, TypeError):
+            key = (chap.volume, (chap.chapter or 0) if num is None else num)
+            if not ranks:
+                if chap.chapter is None:
+                    dedup_none = True
+                selected.setdefault(key, chap)
+                continue
+            rank = min([ranks[g.id] for g in chap.group if g.id in ranks], default=no_rank)
+            group_key = (chap.volume, chap.chapter if num is None else num)
+            best = candidates.get(group_key)
+            if best is None or rank < best[0]:
+                candidates[group_key] = (rank, chap, key)
+
+        for rank, chap, key in candidates.values():
+            if rank == no_rank and not self.groups_substitute:
                 continue
-        return filtered
+            if chap.chapter is None:
+                dedup_none = True
+            selected.setdefault(key, chap)
+
+        return ([chap for _, chap in sorted(selected.items(), key=lambda i: i[0][1])],
+                dedup_none and len(selected) > 1)
 
 
 class DownloadChapter(ActionBase):
+    __slots__ = ("data_obj", "light", "subfolder", "append_title", "volume_dedupe", "net")
+    options = ("light", "subfolder", "append_title", "volume_dedupe")
+    expected_duration = 10
+
     def __init__(self, data, data_obj=None, light=False, subfolder=False, append_title=False, volume_dedupe=False):
         self.data_obj = data_obj
         self.light = light
@@ -228,6 +255,14 @@ class DownloadChapter(ActionBase):
         super().__init__(data)
 
     def run(self, task):
+        try:
+            self._run(task)
+        finally:
+            # The chapter and its MD@H network are only needed while downloading
+            self.data_obj = None
+            self.net = None
+
+    def _run(self, task):
         task.started = True
         task.status = f"Downloading chapter {self.data}"
         p = _task_path(task)
@@ -238,11 +273,8 @@ class DownloadChapter(ActionBase):
             chap = self.data_obj
         else:
             try:
-                md = MangaDexPy.Client()
-                md.session.request = functools.partial(md.session.request, timeout=10)
-                md.session.headers["User-Agent"] = "Proxymiity/MangaDexZip"
-                md.session.headers.pop("Authorization")
-                chap = md.get_chapter(self.data)
+                with task.span("chapter_info", self.data):
+                    chap = metadata.get_chapter(self.data)
             except MangaDexPy.NoContentError:
                 task.failed = True
                 task.status = f"Chapter {self.data} Not Found"
@@ -263,38 +295,71 @@ class DownloadChapter(ActionBase):
             p.mkdir(exist_ok=True)
 
         try:
-            self.net = chap.get_md_network()
+            with task.span("at_home", chap.id):
+                self.net = chap.get_md_network()
         except MangaDexPy.APIError:
             task.failed = True
             task.status = f"MD API Error occurred during server attribution for chapter {chap.id}"
             return
 
         threads = []
+        transfers = []
         pages = self.net.pages_redux if self.light else self.net.pages
+        span = task.add_span("pages", chap.id)
         for x in pages:
-            t = threading.Thread(target=self._page_dl, args=[chap, x, len(pages), p, task])
+            t = threading.Thread(target=self._page_dl, args=[chap, self.net, x, len(pages), p, task, transfers],
+                                 daemon=True)
             threads.append(t)
         for y in threads:
             y.start()
         for i, y in enumerate(threads):
             task.status = f"Downloading " \
                           f"Vol.{chap.volume or '?'} Ch.{chap.chapter or '?'} p.{i}/{len(threads)}"
-            y.join()
+            # Page threads stop on their own once the task is cancelled, don't wait for them
+            while y.is_alive() and not task.cancelled:
+                y.join(0.5)
+        span.end = task.elapsed()
+        # (size, retries) of each page, appended by the page threads
+        span.bytes = sum(t[0] for t in transfers)
+        span.retries = sum(t[1] for t in transfers)
+        if task.cancelled:
+            return
 
         t2 = datetime.now()
         rl_diff = 1.5 - (t2 - t1).total_seconds()
         if rl_diff > 0:
-            sleep(rl_diff)
+            with task.span("rate_limit", chap.id):
+                task.cancel_event.wait(rl_diff)
 
-    def _page_dl(self, chapter, page, pages, path, task):
+    def _page_dl(self, chapter, net, page, pages, path, task, transfers=None):
+        # `net` is passed along rather than read from self.net, which is released while cancelled threads still run
         i = 0
+        size = 0
+        name = self.fmt_page(page.rsplit("/", 1)[1], pages)
+        fp = Path(f"{path}/{name}")
+        if fp.is_file():
+            # Page already downloaded before a worker restart
+            return
+        part = Path(f"{path}/{name}.part")
         while True:
             i += 1
-            name = self.fmt_page(page.rsplit("/", 1)[1], pages)
+            if task.cancelled:
+                break
             try:
-                with self.net.client.session.get(page, timeout=5) as r:
-                    with Path(f"{path}/{name}").open("wb") as f:
-                        f.write(r.content)
+                size = 0
+                _start = monotonic()
+                with net.client.session.get(page, timeout=5, stream=True) as r:
+                    with part.open("wb") as f:
+                        for chunk in r.iter_content(chunk_size=65536):
+                            if task.cancelled:
+                                break
+                            f.write(chunk)
+                            size += len(chunk)
+                if task.cancelled:
+                    part.unlink(missing_ok=True)
+                    break
+                part.replace(fp)
+                _elapsed = monotonic() - _start
 
                 success = True if r.status_code < 400 else False
                 try:
@@ -302,22 +367,34 @@ class DownloadChapter(ActionBase):
                 except KeyError:
                     cached = False
 
+                metrics.page_download_seconds.observe(_elapsed)
+                metrics.page_download_bytes.inc(size)
+                metrics.page_downloads.labels("hit" if cached else "miss", "true" if success else "false").inc()
+                if _elapsed > 0:
+                    metrics.page_download_throughput.observe(size / _elapsed)
+
                 try:
-                    self.net.report(page, success, cached, len(r.content), int(r.elapsed.microseconds/1000))
+                    net.report(page, success, cached, size, int(r.elapsed.microseconds/1000))
                 except MangaDexPy.APIError:
                     pass
 
-            except rex.RequestException:
+            except (rex.RequestException, OSError):
+                if task.cancelled:
+                    # The task directory was removed while writing the page
+                    break
                 if i == 5:
                     task.failed = True
                     task.status = f"MD Node Error when downloading page {name} from chapter {chapter.id}"
                     break
                 task.status = f"MD Node Error when downloading page {name} from chapter {chapter.id}, retrying"
-                sleep(1.5)
-                self.net = chapter.get_md_network()
+                if task.cancel_event.wait(1.5):
+                    break
+                net = chapter.get_md_network()
 
             else:
                 break
+        if transfers is not None:
+            transfers.append((size, i - 1))
 
     @staticmethod
     def fmt_page(page, length):
@@ -328,3 +405,11 @@ class DownloadChapter(ActionBase):
             final_name += "0"
         final_name += num + Path(page).suffix
         return final_name
+
+
+ACTIONS = {a.__name__: a for a in (DefaultCleanupAction, ArchiveContentsZIP, AddMangaChapters, DownloadChapter)}
+
+
+def load_action(name, data, options):
+    """Re-create an action from its class name, data and dumped options."""
+    return ACTIONS[name](data, **options)
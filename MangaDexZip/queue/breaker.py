@@ -0,0 +1,91 @@
+from time import monotonic
+
+import httpx
+
+from .. import metrics
+
+
+class CircuitOpenError(httpx.TransportError):
+    pass
+
+
+class CircuitBreaker:
+    """Tracks consecutive connection failures of a worker, so calls to a dead worker fail immediately.
+
+    The breaker opens after `threshold` consecutive failures. Once `cooldown` seconds have passed, a single call is
+    let through (half-open): the breaker closes if it succeeds, or opens again if it fails."""
+    __slots__ = ("threshold", "cooldown", "state", "failures", "opened_at", "probing", "rejected")
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.rejected = 0
+
+    def __repr__(self):
+        return f"CircuitBreaker(state={self.state}, failures={self.failures})"
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open" and monotonic() >= self.opened_at + self.cooldown:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            self.state = "open"
+            self.opened_at = monotonic()
+
+    def release(self):
+        """Give up a half-open probe without a result, e.g. when the call was cancelled."""
+        self.probing = False
+
+    def info(self):
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected,
+                "retry_in": round(max(self.opened_at + self.cooldown - monotonic(), 0), 2)
+                if self.state == "open" else 0}
+
+
+class CircuitBreakerTransport(httpx.AsyncHTTPTransport):
+    """HTTP transport failing fast with `CircuitOpenError` while its breaker is open.
+
+    Only connection errors and timeouts count as failures, error responses still mean the worker is alive.
+    Response times are reported to the `mdzip_worker_request_seconds` metric."""
+    def __init__(self, breaker, worker_uid=None, **kwargs):
+        super().__init__(**kwargs)
+        self.breaker = breaker
+        self.worker_uid = worker_uid
+
+    async def handle_async_request(self, request):
+        if not self.breaker.allow():
+            metrics.worker_request_seconds.labels(self.worker_uid, "rejected").observe(0)
+            raise CircuitOpenError("Worker circuit is open", request=request)
+        start = monotonic()
+        try:
+            response = await super().handle_async_request(request)
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            metrics.worker_request_seconds.labels(self.worker_uid, "error").observe(monotonic() - start)
+            raise
+        except BaseException:
+            # Cancelled or failed for another reason, the worker's health is unknown
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        metrics.worker_request_seconds.labels(self.worker_uid, "ok").observe(monotonic() - start)
+        return response
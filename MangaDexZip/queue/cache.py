@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TTLCache:
+    """Thread-safe mapping with both a maximum size (least recently set entries go first) and a time to live."""
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return f"TTLCache(size={len(self.data)}, maxsize={self.maxsize}, ttl={self.ttl})"
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count=True):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and item[1] < monotonic():
+                self.data.pop(key)
+                self.evictions += 1
+                item = None
+            if count:
+                if item is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return default if item is None else item[0]
+
+    def set(self, key, value):
+        with self.lock:
+            now = monotonic()
+            self.data[key] = (value, now + self.ttl)
+            self.data.move_to_end(key)
+            while self.data:
+                _, (_, expires_at) = next(iter(self.data.items()))
+                if len(self.data) <= self.maxsize and expires_at >= now:
+                    break
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.data.pop(key, None)
+        return default if item is None else item[0]
+
+    def stats(self):
+        return {"size": len(self.data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
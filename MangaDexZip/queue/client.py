@@ -1,17 +1,60 @@
-import requests
-from requests.exceptions import RequestException
+import httpx
+from httpx import HTTPError
 from json.decoder import JSONDecodeError
+from json import loads, dumps
 
 from datetime import datetime, timedelta
 
 import random
+import asyncio
+import logging
 
+from .cache import TTLCache
+from .breaker import CircuitBreaker, CircuitBreakerTransport
+
+from .. import metrics
 from ..config import config
 
 BACKENDS = config["frontend"]["backends"]
-TASK_CACHE_TTL = timedelta(seconds=config["frontend"]["task_cache_ttl"])
-
-task_cache = {}
+TASK_CACHE_TTL = config["frontend"]["task_cache_ttl"]
+TASK_CACHE_SIZE = config["frontend"].get("task_cache_size", 100000)
+POOL_SIZE = config["frontend"].get("pool_size", 16)
+FAN_OUT_DEADLINE = config["frontend"].get("fan_out_deadline", 2)
+HEARTBEAT_INTERVAL = config["frontend"].get("heartbeat_interval", 2)
+HEARTBEAT_TTL = timedelta(seconds=config["frontend"].get("heartbeat_ttl", 10))
+PROXY_CHUNK_SIZE = config["frontend"].get("proxy_chunk_size", 1048576)
+PROXY_TIMEOUT = config["frontend"].get("proxy_timeout", 30)
+SELECTION_POLICY = config["frontend"].get("selection_policy", "p2c")
+BREAKER_THRESHOLD = config["frontend"].get("breaker_threshold", 3)
+BREAKER_COOLDOWN = config["frontend"].get("breaker_cooldown", 10)
+EVENTS_READ_TIMEOUT = 30
+EVENTS_POLL_INTERVAL = 2.5
+# Estimated wait added to a worker with an empty queue when it is sent a task, until its next heartbeat
+NEW_TASK_WAIT = 10
+
+logger = logging.getLogger(__name__)
+
+task_cache = TTLCache(TASK_CACHE_SIZE, TASK_CACHE_TTL)
+request_index = TTLCache(TASK_CACHE_SIZE, TASK_CACHE_TTL)
+worker_loads = {}
+sessions: dict[str, httpx.AsyncClient] = {}
+breakers: dict[str, CircuitBreaker] = {}
+heartbeat_task: asyncio.Task = None
+subscriptions = {}
+
+
+def _cache_metrics(counter):
+    return lambda: {("task",): getattr(task_cache, counter), ("request",): getattr(request_index, counter)}
+
+
+if config["frontend"]["enabled"]:
+    metrics.Counter("mdzip_cache_hits_total", "Frontend cache hits, by cache.", ("cache",), fn=_cache_metrics("hits"))
+    metrics.Counter("mdzip_cache_misses_total", "Frontend cache misses, by cache.", ("cache",),
+                    fn=_cache_metrics("misses"))
+    metrics.Gauge("mdzip_cache_entries", "Frontend cache size, by cache.", ("cache",),
+                  fn=lambda: {("task",): len(task_cache), ("request",): len(request_index)})
+    metrics.Gauge("mdzip_worker_circuit_open", "Whether requests to the worker currently fail immediately.",
+                  ("worker",), fn=lambda: {(k,): int(b.state == "open") for k, b in breakers.copy().items()})
 
 
 class WorkerProxyDisabledError(Exception):
@@ -26,13 +69,42 @@ class WorkerTaskNotSupportedError(Exception):
     pass
 
 
-def reload_workers():
+async def reload_workers():
     config.reload()
     for k in BACKENDS.copy():
         if k not in config["frontend"]["backends"]:
             BACKENDS.pop(k)
     for k, v in config["frontend"]["backends"].items():
         BACKENDS[k] = v
+    for k in tuple(sessions.keys()):
+        await close_session(k)
+
+
+def get_session(worker_uid):
+    """Get the keep-alive client used to communicate with a worker."""
+    if worker_uid not in sessions:
+        limits = httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE)
+        transport = CircuitBreakerTransport(get_breaker(worker_uid), worker_uid=worker_uid, limits=limits)
+        sessions[worker_uid] = httpx.AsyncClient(transport=transport)
+    return sessions[worker_uid]
+
+
+async def close_session(worker_uid):
+    """Close a worker's client and reset its circuit breaker, e.g. when the worker is edited or removed."""
+    breakers.pop(worker_uid, None)
+    s = sessions.pop(worker_uid, None)
+    if s:
+        await s.aclose()
+
+
+def get_breaker(worker_uid):
+    if worker_uid not in breakers:
+        breakers[worker_uid] = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+    return breakers[worker_uid]
+
+
+def _headers(worker):
+    return {"Authorization": worker["token"]} if worker["token"] else {}
 
 
 def available_workers():
@@ -47,154 +119,478 @@ def select_worker_random():
     return random.choice(tuple(available_workers().keys()))
 
 
-def select_worker_auto():
-    workers = {}
-    for k in available_workers().keys():
-        q = query(k)
-        if q:
-            if not BACKENDS[k]["skip_ready_check"]:
-                if not query_status(k):
-                    continue
-            workers[k] = q["active_groups"]
-    if not workers:
+async def fan_out(fn, worker_uids, *args, deadline=None):
+    """Call `fn(worker_uid, *args)` on all workers concurrently.
+
+    Returns a dict of the results received before the deadline, workers that didn't answer in time are left out."""
+    tasks = {asyncio.ensure_future(fn(k, *args)): k for k in worker_uids}
+    if not tasks:
+        return {}
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for t in pending:
+        t.cancel()
+    return {tasks[t]: t.result() for t in done}
+
+
+async def fan_out_iter(fn, worker_uids, *args, deadline=None):
+    """Call `fn(worker_uid, *args)` on all workers concurrently, and yield (worker_uid, result) tuples as they come.
+
+    Workers that didn't answer before the deadline are left out."""
+    async def _call(k):
+        return k, await fn(k, *args)
+
+    tasks = [asyncio.ensure_future(_call(k)) for k in worker_uids]
+    try:
+        for f in asyncio.as_completed(tasks, timeout=deadline):
+            yield await f
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+async def fan_out_first(fn, worker_uids, *args, deadline=None):
+    """Call `fn(worker_uid, *args)` on all workers concurrently, and return the first truthy result.
+
+    Returns a (worker_uid, result) tuple, or (None, None) if no worker answered before the deadline."""
+    async def _call(k):
+        return k, await fn(k, *args)
+
+    tasks = [asyncio.ensure_future(_call(k)) for k in worker_uids]
+    try:
+        for f in asyncio.as_completed(tasks, timeout=deadline):
+            k, r = await f
+            if r:
+                return k, r
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for t in tasks:
+            t.cancel()
+    return None, None
+
+
+async def _query_ready(worker_uid):
+    # Workers can be removed by admins while they are being queried
+    if worker_uid not in BACKENDS:
         return None
-    lowest_workers = [k for k, v in workers.items() if v == min(workers.values())]
+    q = await query(worker_uid)
+    worker = BACKENDS.get(worker_uid)
+    if not q or worker is None:
+        return None
+    if not worker["skip_ready_check"] and not await query_status(worker_uid):
+        return None
+    return q
+
+
+async def _heartbeat_loop():
+    while True:
+        try:
+            # No deadline, so that hung workers time out and trip their circuit breaker
+            for k, q in (await fan_out(_query_ready, tuple(BACKENDS.keys()))).items():
+                if q and k in BACKENDS:
+                    worker_loads[k] = (q, datetime.utcnow())
+                else:
+                    worker_loads.pop(k, None)
+        except Exception:
+            logger.exception("Worker heartbeat failed")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def start_heartbeat():
+    global heartbeat_task
+    heartbeat_task = asyncio.create_task(_heartbeat_loop())
+
+
+async def shutdown():
+    """Stop the heartbeat and close the clients of all workers."""
+    if heartbeat_task:
+        heartbeat_task.cancel()
+    for worker_uid in tuple(sessions):
+        await close_session(worker_uid)
+
+
+def get_worker_loads():
+    """Get the last known load of ready workers, ignoring workers that haven't answered recently."""
+    now = datetime.utcnow()
+    available = available_workers()
+    return {k: q for k, (q, at) in worker_loads.copy().items() if k in available and (at + HEARTBEAT_TTL) > now}
+
+
+def _worker_cost(worker_uid, load):
+    # Workers older than the estimate only report their queued actions
+    return load.get("estimated_wait", 0), load["queued_actions"], -BACKENDS[worker_uid]["priority"]
+
+
+def _select_groups(workers):
+    """Worker with the fewest active groups, ties are broken by priority."""
+    lowest_workers = [k for k, q in workers.items()
+                      if q["active_groups"] == min(q["active_groups"] for q in workers.values())]
     lowest_workers.sort(key=lambda x: BACKENDS[x]["priority"], reverse=True)
     return lowest_workers[0]
 
 
-def query(worker_uid):
+def _select_least_wait(workers):
+    """Worker with the lowest estimated time to process its queue."""
+    return min(workers, key=lambda k: _worker_cost(k, workers[k]))
+
+
+def _select_p2c(workers):
+    """Power of two choices: the least loaded of two random workers, which avoids sending every task
+    to the same worker between two heartbeats."""
+    candidates = random.sample(tuple(workers), min(2, len(workers)))
+    return min(candidates, key=lambda k: _worker_cost(k, workers[k]))
+
+
+SELECTION_POLICIES = {
+    "groups": _select_groups,
+    "least_wait": _select_least_wait,
+    "p2c": _select_p2c
+}
+
+
+async def select_worker_auto():
+    loads = get_worker_loads()
+    if not loads:
+        # Nothing known yet (e.g. frontend just started), ask workers directly
+        loads = await fan_out(_query_ready, available_workers().keys(), deadline=FAN_OUT_DEADLINE)
+    workers = {k: q for k, q in loads.items() if q}
+    if not workers:
+        return None
+    return SELECTION_POLICIES[SELECTION_POLICY](workers)
+
+
+def request_key(task_type, task_data, task_opt_data):
+    return dumps([task_type, task_data, task_opt_data], sort_keys=True)
+
+
+def select_worker_coalesced(task_type, task_data, task_opt_data):
+    """Get the worker that received an identical request recently, so it can re-use the existing task."""
+    worker_uid = request_index.get(request_key(task_type, task_data, task_opt_data))
+    if not worker_uid or worker_uid not in available_workers():
+        return None
+    loads = get_worker_loads()
+    if loads and worker_uid not in loads:
+        return None
+    return worker_uid
+
+
+async def query(worker_uid):
     worker = BACKENDS[worker_uid]
     try:
-        req = requests.get(f"{worker['url']}/queue/back",
-                           headers={
-                               "Authorization": worker["token"]
-                           },
-                           timeout=worker["timeout"])
+        req = await get_session(worker_uid).get(f"{worker['url']}/queue/back",
+                                                headers=_headers(worker),
+                                                timeout=worker["timeout"])
         if req.status_code != 200:
             return None
         return req.json()
-    except (RequestException, JSONDecodeError):
+    except (HTTPError, JSONDecodeError):
         return None
 
 
-def query_status(worker_uid):
+async def query_status(worker_uid):
     worker = BACKENDS[worker_uid]
     try:
-        req = requests.get(f"{worker['url']}/queue/back/ready",
-                           headers={
-                               "Authorization": worker["token"]
-                           },
-                           timeout=worker["timeout"])
+        req = await get_session(worker_uid).get(f"{worker['url']}/queue/back/ready",
+                                                headers=_headers(worker),
+                                                timeout=worker["timeout"])
         if req.status_code != 200:
             return None
         return req.json()
-    except (RequestException, JSONDecodeError):
+    except (HTTPError, JSONDecodeError):
         return None
 
 
-def append(worker_uid, task_type, task_data, task_opt_data, task_group):
+async def append(worker_uid, task_type, task_data, task_opt_data, task_group):
     worker = BACKENDS[worker_uid]
     try:
-        req = requests.post(f"{worker['url']}/queue/back/new",
-                            json={
-                                "type": task_type,
-                                "data": task_data,
-                                "opt_data": task_opt_data,
-                                "group": task_group
-                            },
-                            headers={
-                                "Authorization": worker["token"]
-                            },
-                            timeout=worker["timeout"])
+        req = await get_session(worker_uid).post(f"{worker['url']}/queue/back/new",
+                                                 json={
+                                                     "type": task_type,
+                                                     "data": task_data,
+                                                     "opt_data": task_opt_data,
+                                                     "group": task_group,
+                                                     "prefix": worker_uid
+                                                 },
+                                                 headers=_headers(worker),
+                                                 timeout=worker["timeout"])
         if req.status_code != 200:
             return None
         task = req.json()
-        task_cache[task["task_id"]] = (worker_uid, datetime.utcnow())
+        task_cache.set(task["task_id"], worker_uid)
+        request_index.set(request_key(task_type, task_data, task_opt_data), worker_uid)
+        metrics.tasks_submitted.labels(task_type, worker_uid).inc()
+        if worker_uid in worker_loads:
+            # Account for the new task until the next heartbeat, so the next tasks don't all go to this worker
+            load = worker_loads[worker_uid][0]
+            if "estimated_wait" in load:
+                load["estimated_wait"] += (load["estimated_wait"] / load["queued_actions"]
+                                           if load["queued_actions"] else 0) or NEW_TASK_WAIT
+            load["active_groups"] += 1
+            load["queued_actions"] += 1
         return task
-    except (RequestException, JSONDecodeError):
+    except (HTTPError, JSONDecodeError):
         return None
 
 
-def get_info(task_uid):
-    if task_uid in task_cache:
-        if (task_cache[task_uid][1] + TASK_CACHE_TTL) > datetime.utcnow():
-            _ti = _get_info_from_worker(task_cache[task_uid][0], task_uid)
-            if _ti:
-                task_cache[task_uid] = (task_cache[task_uid][0], datetime.utcnow())
-                return _ti
-    for k in BACKENDS.keys():
-        _ti = _get_info_from_worker(k, task_uid)
+def get_owner(task_uid):
+    """Get the worker owning a task, using the worker prefix of the task ID or the task cache."""
+    if "." in task_uid:
+        prefix = task_uid.rsplit(".", 1)[0]
+        if prefix in BACKENDS:
+            return prefix
+    return task_cache.get(task_uid, count=False)
+
+
+async def get_info(task_uid, spans=False):
+    if "." in task_uid and task_uid.rsplit(".", 1)[0] in BACKENDS:
+        # Task IDs prefixed with their worker are routed directly
+        return await _get_info_from_worker(task_uid.rsplit(".", 1)[0], task_uid, spans)
+    k = task_cache.get(task_uid)
+    if k in BACKENDS:
+        _ti = await _get_info_from_worker(k, task_uid, spans)
         if _ti:
-            task_cache[task_uid] = (k, datetime.utcnow())
+            task_cache.set(task_uid, k)
             return _ti
+    k, _ti = await fan_out_first(_get_info_from_worker, BACKENDS.keys(), task_uid, spans,
+                                 deadline=FAN_OUT_DEADLINE)
+    if _ti:
+        task_cache.set(task_uid, k)
+        return _ti
     return None
 
 
-def get_all(worker_uid):
+async def get_info_batch(task_uids):
+    """Get info for multiple tasks, with a single request per worker.
+
+    Tasks whose worker isn't known are looked up on all workers at once. Tasks that weren't found are left out."""
+    by_worker, unknown = {}, []
+    for t in task_uids:
+        k = get_owner(t)
+        if k in BACKENDS:
+            by_worker.setdefault(k, []).append(t)
+        else:
+            unknown.append(t)
+
+    infos = {}
+    for data in await asyncio.gather(*[_get_info_batch_from_worker(k, v) for k, v in by_worker.items()]):
+        infos.update(data or {})
+    if unknown:
+        for k, data in (await fan_out(_get_info_batch_from_worker, BACKENDS.keys(), unknown,
+                                      deadline=FAN_OUT_DEADLINE)).items():
+            for t in data or {}:
+                task_cache.set(t, k)
+            infos.update(data or {})
+    return infos
+
+
+async def _get_info_batch_from_worker(worker_uid, task_uids):
     worker = BACKENDS[worker_uid]
     try:
-        req = requests.get(f"{worker['url']}/queue/back/all",
-                           headers={
-                               "Authorization": worker["token"]
-                           },
-                           timeout=worker["timeout"])
+        req = await get_session(worker_uid).post(f"{worker['url']}/queue/back/batch",
+                                                 json={"task_ids": task_uids},
+                                                 headers=_headers(worker),
+                                                 timeout=worker["timeout"])
         if req.status_code != 200:
             return None
         return req.json()
-    except (RequestException, JSONDecodeError):
+    except (HTTPError, JSONDecodeError):
         return None
 
 
-def _get_info_from_worker(worker_uid, task_uid):
+async def get_all(worker_uid, spans=False):
     worker = BACKENDS[worker_uid]
     try:
-        req = requests.get(f"{worker['url']}/queue/back/{task_uid}",
-                           headers={
-                                "Authorization": worker["token"]
-                            },
-                           timeout=worker["timeout"])
+        req = await get_session(worker_uid).get(f"{worker['url']}/queue/back/all",
+                                                params={"spans": "true"} if spans else None,
+                                                headers=_headers(worker),
+                                                timeout=worker["timeout"])
         if req.status_code != 200:
             return None
         return req.json()
-    except (RequestException, JSONDecodeError):
+    except (HTTPError, JSONDecodeError):
         return None
 
 
-def mark_failed(task_uid):
-    if task_uid not in task_cache:
-        d = get_info(task_uid)
+async def get_profile(worker_uid, duration, interval):
+    """Profile a worker, returns the collapsed stacks, or the status code if the worker refused."""
+    worker = BACKENDS[worker_uid]
+    try:
+        req = await get_session(worker_uid).get(f"{worker['url']}/queue/back/profile",
+                                                params={"duration": duration, "interval": interval},
+                                                headers=_headers(worker),
+                                                timeout=worker["timeout"] + min(max(duration, 0), 60))
+        if req.status_code != 200:
+            return req.status_code
+        return req.text
+    except HTTPError:
+        return None
+
+
+async def get_tasks(worker_uid, params):
+    worker = BACKENDS[worker_uid]
+    try:
+        req = await get_session(worker_uid).get(f"{worker['url']}/queue/back/tasks",
+                                                params=params,
+                                                headers=_headers(worker),
+                                                timeout=worker["timeout"])
+        if req.status_code != 200:
+            return None
+        return req.json()
+    except (HTTPError, JSONDecodeError):
+        return None
+
+
+async def _get_info_from_worker(worker_uid, task_uid, spans=False):
+    worker = BACKENDS[worker_uid]
+    try:
+        req = await get_session(worker_uid).get(f"{worker['url']}/queue/back/{task_uid}",
+                                                params={"spans": "true"} if spans else None,
+                                                headers=_headers(worker),
+                                                timeout=worker["timeout"])
+        if req.status_code != 200:
+            return None
+        return req.json()
+    except (HTTPError, JSONDecodeError):
+        return None
+
+
+async def mark_failed(task_uid):
+    if not get_owner(task_uid):
+        d = await get_info(task_uid)
         if not d:
             raise FileNotFoundError("Task not found")
-    worker = BACKENDS[task_cache[task_uid][0]]
+    worker_uid = get_owner(task_uid)
+    if worker_uid not in BACKENDS:
+        # The worker owning the task was removed
+        raise FileNotFoundError("Task not found")
+    worker = BACKENDS[worker_uid]
     try:
-        req = requests.delete(f"{worker['url']}/queue/back/{task_uid}",
-                              headers={
-                                  "Authorization": worker["token"]
-                              },
-                              timeout=worker["timeout"])
+        req = await get_session(worker_uid).delete(f"{worker['url']}/queue/back/{task_uid}",
+                                                   headers=_headers(worker),
+                                                   timeout=worker["timeout"])
         if req.status_code != 200:
             return None
         return req.json()
-    except (RequestException, JSONDecodeError):
+    except (HTTPError, JSONDecodeError):
         return None
 
 
-def proxy_data(task_uid):
-    if task_uid not in task_cache:
-        d = get_info(task_uid)
+async def proxy_data(task_uid):
+    if not get_owner(task_uid):
+        d = await get_info(task_uid)
         if not d:
             raise FileNotFoundError("Task not found")
-    worker = BACKENDS[task_cache[task_uid][0]]
+    worker_uid = get_owner(task_uid)
+    if worker_uid not in BACKENDS:
+        # The worker owning the task was removed
+        raise FileNotFoundError("Task not found")
+    worker = BACKENDS[worker_uid]
     if not worker["proxy_data"]:
         raise WorkerProxyDisabledError("Worker does not allow proxying")
 
-    with requests.get(f"{worker['url']}/queue/back/{task_uid}/data", headers={"Authorization": worker["token"]}) as r:
-        if r.status_code == 404:
-            raise FileNotFoundError("Task not found")
-        if r.status_code == 403:
-            raise WorkerFileNotReadyError("Worker file not ready")
-        if r.status_code == 503:
-            raise WorkerTaskNotSupportedError("Worker unknown task kind")
-        r.raise_for_status()
-        return r
+    session = get_session(worker_uid)
+    r = await session.send(session.build_request("GET", f"{worker['url']}/queue/back/{task_uid}/data",
+                                                 headers=_headers(worker), timeout=PROXY_TIMEOUT),
+                           stream=True)
+    if r.status_code != 200:
+        await r.aclose()
+    if r.status_code == 404:
+        raise FileNotFoundError("Task not found")
+    if r.status_code == 403:
+        raise WorkerFileNotReadyError("Worker file not ready")
+    if r.status_code == 503:
+        raise WorkerTaskNotSupportedError("Worker unknown task kind")
+    r.raise_for_status()
+    return r
+
+
+async def iter_data(r):
+    """Stream a proxied response's body as-is, and release the worker connection once done or aborted."""
+    try:
+        async for chunk in r.aiter_raw(chunk_size=PROXY_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await r.aclose()
+
+
+class TaskSubscription:
+    """Single upstream subscription to a task's updates, shared by all of the task's watchers."""
+    def __init__(self, task_uid):
+        self.task_uid = task_uid
+        self.watchers: set[asyncio.Queue] = set()
+        self.last = None
+        self.runner: asyncio.Task = None
+
+    def __repr__(self):
+        return f"TaskSubscription(task_uid={self.task_uid}, watchers={len(self.watchers)})"
+
+    def publish(self, info):
+        if info == self.last:
+            return
+        self.last = info
+        for q in self.watchers:
+            q.put_nowait(info)
+
+    def close(self):
+        if subscriptions.get(self.task_uid) is self:
+            subscriptions.pop(self.task_uid)
+        for q in self.watchers:
+            q.put_nowait(None)
+
+
+async def watch(task_uid):
+    """Yield a task's info each time it changes, until the task is completed or failed."""
+    sub = subscriptions.get(task_uid)
+    if not sub:
+        sub = subscriptions[task_uid] = TaskSubscription(task_uid)
+        sub.runner = asyncio.create_task(_subscribe(sub))
+    q = asyncio.Queue()
+    if sub.last:
+        q.put_nowait(sub.last)
+    sub.watchers.add(q)
+    try:
+        while True:
+            info = await q.get()
+            if info is None:
+                return
+            yield info
+    finally:
+        sub.watchers.discard(q)
+        if not sub.watchers and not sub.runner.done():
+            if subscriptions.get(task_uid) is sub:
+                subscriptions.pop(task_uid)
+            sub.runner.cancel()
+
+
+async def _subscribe(sub):
+    try:
+        worker_uid = get_owner(sub.task_uid)
+        if not worker_uid and await get_info(sub.task_uid):
+            worker_uid = get_owner(sub.task_uid)
+        if worker_uid in BACKENDS:
+            worker = BACKENDS[worker_uid]
+            try:
+                async with get_session(worker_uid).stream(
+                        "GET", f"{worker['url']}/queue/back/{sub.task_uid}/events", headers=_headers(worker),
+                        timeout=httpx.Timeout(worker["timeout"], read=EVENTS_READ_TIMEOUT)) as r:
+                    if r.status_code == 200:
+                        async for line in r.aiter_lines():
+                            if line.startswith("data: "):
+                                sub.publish(loads(line[6:]))
+                        return
+            except (HTTPError, JSONDecodeError):
+                pass
+
+        # Workers without the events endpoint, or lost streams, are polled instead
+        while True:
+            info = await get_info(sub.task_uid)
+            if not info:
+                return
+            sub.publish(info)
+            if info["completed"] or info["failed"]:
+                return
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+    finally:
+        sub.close()
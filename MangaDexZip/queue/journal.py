@@ -0,0 +1,158 @@
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from json import dumps, loads
+from datetime import datetime
+
+from .tasks import Task, TaskGroup
+from .actions import load_action
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    uid TEXT PRIMARY KEY,
+    grp TEXT,
+    kind TEXT,
+    started INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    status TEXT,
+    status_override TEXT,
+    result TEXT,
+    created_at TEXT NOT NULL,
+    referenced_at TEXT
+);
+CREATE TABLE IF NOT EXISTS actions (
+    task_uid TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    data TEXT,
+    options TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (task_uid, idx)
+);
+"""
+
+
+class TaskJournal:
+    """Persists task and action state transitions to a local SQLite database (WAL mode).
+
+    The journal is only written to, except on startup where `restore` rebuilds the scheduler from it."""
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+            # Journals created before tasks were re-used by identical requests
+            if "referenced_at" not in [c[1] for c in self.db.execute("PRAGMA table_info(tasks)")]:
+                self.db.execute("ALTER TABLE tasks ADD COLUMN referenced_at TEXT")
+
+    def __repr__(self):
+        return f"TaskJournal(path={self.path})"
+
+    @property
+    def enabled(self):
+        return self.db is not None
+
+    @contextmanager
+    def _transaction(self):
+        """Run the writes of the block in one transaction, rolled back if any of them fails.
+
+        Errors are logged instead of raised, so a broken journal (e.g. a full disk) never stops the scheduler."""
+        with self.lock:
+            try:
+                with self.db:
+                    self.db.execute("BEGIN")
+                    yield self.db
+            except sqlite3.Error as e:
+                logger.error(f"Could not write to the task journal: {e}")
+
+    @staticmethod
+    def _task_row(task):
+        return (task.parent.uid if task.parent else None, task.kind,
+                int(task.started), int(task.completed), int(task.failed),
+                task.status, task.status_override, task.result,
+                task.created_at.isoformat(), task.referenced_at.isoformat(), task.uid)
+
+    def save_task(self, task):
+        """Write the task and its whole action list, used when actions are added."""
+        if not self.enabled:
+            return
+        _queued = {id(a) for a in task.queued_actions}
+        _actions = [(task.uid, i, a.__class__.__name__, dumps(a.data), dumps(a.dump()),
+                     int(id(a) not in _queued)) for i, a in enumerate(task.actions)]
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO tasks "
+                       "(grp, kind, started, completed, failed, status, status_override, result, "
+                       "created_at, referenced_at, uid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._task_row(task))
+            db.execute("DELETE FROM actions WHERE task_uid = ?", (task.uid,))
+            db.executemany("INSERT INTO actions (task_uid, idx, name, data, options, done) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", _actions)
+
+    def update_task(self, task, action=None):
+        """Write the task's state, optionally marking a single action as done."""
+        if not self.enabled:
+            return
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET grp = ?, kind = ?, started = ?, completed = ?, failed = ?, "
+                       "status = ?, status_override = ?, result = ?, created_at = ?, referenced_at = ? WHERE uid = ?",
+                       self._task_row(task))
+            if action is not None and action in task.actions:
+                db.execute("UPDATE actions SET done = 1 WHERE task_uid = ? AND idx = ?",
+                           (task.uid, task.actions.index(action)))
+
+    def remove_task(self, task):
+        if not self.enabled:
+            return
+        with self._transaction() as db:
+            db.execute("DELETE FROM actions WHERE task_uid = ?", (task.uid,))
+            db.execute("DELETE FROM tasks WHERE uid = ?", (task.uid,))
+
+    def restore(self, scheduler):
+        """Rebuild tasks, groups and pending actions from the journal.
+
+        Actions that were running when the worker stopped are queued again, and resume from the files on disk."""
+        if not self.enabled:
+            return 0
+        with self.lock:
+            _tasks = self.db.execute("SELECT uid, grp, kind, started, completed, failed, status, status_override, "
+                                     "result, created_at, referenced_at FROM tasks ORDER BY created_at").fetchall()
+            _actions = {}
+            for task_uid, name, data, options, done in self.db.execute(
+                    "SELECT task_uid, name, data, options, done FROM actions ORDER BY task_uid, idx"):
+                _actions.setdefault(task_uid, []).append((name, data, options, done))
+
+        for (uid, grp, kind, started, completed, failed, status, status_override, result,
+             created_at, referenced_at) in _tasks:
+            if not grp:
+                continue
+            task = Task(uid, kind=kind)
+            task.started = bool(started)
+            task.completed = bool(completed)
+            task.failed = bool(failed)
+            task.status = status
+            task.status_override = status_override
+            task.result = result
+            task.created_at = datetime.fromisoformat(created_at)
+            task.referenced_at = datetime.fromisoformat(referenced_at) if referenced_at else task.created_at
+
+            for name, data, options, done in _actions.get(uid, []):
+                a = load_action(name, loads(data), loads(options))
+                task.actions.append(a)
+                if not done:
+                    task.queued_actions.append(a)
+            if task.queued_actions and not task.failed:
+                task.status = "Task resumed after worker restart"
+            if task.actions and not task.failed:
+                task.set_fingerprint(Task.fingerprint_of(task.actions[0]))
+
+            group = TaskGroup.get_group(grp)
+            group.add_task(task)
+            scheduler.add_group(group)
+        return len(_tasks)
@@ -1,5 +1,6 @@
 import threading
-from time import sleep
+from time import sleep, monotonic
+from collections import Counter, deque
 from datetime import datetime, timedelta
 
 from pathlib import Path
@@ -7,7 +8,9 @@ from os import listdir
 from shutil import disk_usage
 
 from .tasks import TaskScheduler
+from .journal import TaskJournal
 
+from .. import metrics
 from ..config import config
 
 SCHEDULER_EMPTY_WAIT = config["backend"]["scheduler_empty_wait"]
@@ -16,8 +19,12 @@ TASK_EMPTY_TTL = timedelta(seconds=config["backend"]["task_empty_ttl"])
 CLEANUP_INTERVAL = config["backend"]["cleanup_interval"]
 TEMP_PATH = Path(config["backend"]["temp_path"])
 LIMITS = config["backend"]["limits"]
+JOURNAL_PATH = config["backend"].get("journal_path")
+ESTIMATE_SAMPLES = 50
 
 scheduler = TaskScheduler()
+journal = TaskJournal(JOURNAL_PATH if config["backend"]["enabled"] else None)
+action_durations: dict[str, deque] = {}
 
 
 def _scheduler_loop():
@@ -29,11 +36,28 @@ def _scheduler_loop():
             g = scheduler.next_group()
             t = g.next_task()
             a = t.next_action()
+            _actions = len(t.actions)
+            if not t.started:
+                _wait = t.elapsed()
+                metrics.queue_wait_seconds.observe(_wait)
+                t.add_span("queue_wait", start=0, end=_wait)
+            _span = t.add_span(a.__class__.__name__, a.data)
+            _start = monotonic()
             try:
                 a.run(t)
             except Exception as e:
                 t.failed = True
                 t.status = f"A critical error occurred while processing the task ({e})"
+            _span.end = t.elapsed()
+            # Failed actions usually end early (e.g. MangaDex unreachable) and would make the estimate too optimistic
+            if not t.cancelled and not t.failed:
+                _record_duration(a, monotonic() - _start)
+            if t.cancelled:
+                t.get_cleanup_action().run(t)
+            if len(t.actions) != _actions:
+                journal.save_task(t)
+            else:
+                journal.update_task(t, a)
 
 
 def _cleanup_loop():
@@ -42,12 +66,16 @@ def _cleanup_loop():
         for g in scheduler.groups:
             for t in g.tasks.copy():
                 if t.actions:
-                    if now > (t.created_at + TASK_TTL):
+                    # Completed tasks are kept for as long as identical requests keep re-using them
+                    if now > ((t.referenced_at if t.completed else t.created_at) + TASK_TTL):
+                        t.cancel("Task expired")
                         t.get_cleanup_action().run(t)
                         t.delete_task()
+                        journal.remove_task(t)
                 else:
                     if now > (t.created_at + TASK_EMPTY_TTL):
                         t.delete_task()
+                        journal.remove_task(t)
         for g in scheduler.groups.copy():
             if not g.tasks:
                 g.delete_group()
@@ -58,6 +86,45 @@ scheduler_thread = threading.Thread(target=_scheduler_loop)
 cleanup_thread = threading.Thread(target=_cleanup_loop)
 
 
+def _disk_metrics():
+    try:
+        du = disk_usage(TEMP_PATH)
+    except FileNotFoundError:
+        return {}
+    return {("total",): du.total, ("used",): du.used, ("free",): du.free}
+
+
+def _queue_metrics():
+    return {("groups",): len(scheduler.groups),
+            ("active_groups",): len(scheduler.active_groups),
+            ("tasks",): sum([len(g.tasks) for g in scheduler.groups]),
+            ("queued_actions",): sum([sum([len(t.queued_actions) for t in g.active_tasks])
+                                      for g in scheduler.active_groups])}
+
+
+def restore_tasks():
+    return journal.restore(scheduler)
+
+
+def _record_duration(action, duration):
+    name = action.__class__.__name__
+    if name not in action_durations:
+        action_durations[name] = deque(maxlen=ESTIMATE_SAMPLES)
+    action_durations[name].append(duration)
+    metrics.action_duration_seconds.labels(name).observe(duration)
+
+
+def estimate_wait():
+    """Estimate how long (in seconds) the worker needs to process all queued actions.
+
+    Each queued action is weighted by the average duration of the last actions of the same kind, or by its
+    `expected_duration` if none of them ran since the worker started (e.g. after restoring tasks from the journal)."""
+    averages = {k: sum(v) / len(v) for k, v in action_durations.copy().items() if v}
+    queued = Counter(a.__class__
+                     for g in scheduler.active_groups for t in g.active_tasks for a in t.queued_actions)
+    return round(float(sum(averages.get(k.__name__, k.expected_duration) * n for k, n in queued.items())), 2)
+
+
 def check_status():
     if not scheduler_thread.is_alive():
         return False
@@ -76,6 +143,9 @@ def check_status():
     if LIMITS["max_active_tasks"]:
         if sum([len(g.active_tasks) for g in scheduler.active_groups]) >= LIMITS["max_active_tasks"]:
             return False
+    if LIMITS.get("max_estimated_wait"):
+        if estimate_wait() >= LIMITS["max_estimated_wait"]:
+            return False
     try:
         du = disk_usage(TEMP_PATH)
         total, used, free = round(du.total / 1000000, 2), round(du.used / 1000000, 2), round(du.free / 1000000, 2)
@@ -114,3 +184,11 @@ def check_status():
         return False
 
     return True
+
+
+if config["backend"]["enabled"]:
+    metrics.Gauge("mdzip_disk_bytes", "Disk space of the worker's partition.", ("type",), fn=_disk_metrics)
+    metrics.Gauge("mdzip_queue_size", "Number of groups, tasks and queued actions on the worker.", ("type",),
+                  fn=_queue_metrics)
+    metrics.Gauge("mdzip_queue_estimated_wait_seconds", "Estimated time to process all queued actions.",
+                  fn=estimate_wait)
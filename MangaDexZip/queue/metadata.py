@@ -0,0 +1,150 @@
+import functools
+import threading
+from json import dumps
+from time import monotonic, sleep
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import MangaDexPy
+
+from .cache import TTLCache
+from .. import metrics
+from ..config import config
+
+CACHE_TTL = config["backend"].get("metadata_cache_ttl", 300)
+CACHE_SIZE = config["backend"].get("metadata_cache_size", 1000)
+FEED_MAX_AGE = config["backend"].get("feed_max_age")
+FEED_CONCURRENCY = config["backend"].get("feed_concurrency", 4)
+FEED_PAGE_SIZE = 100
+API_RATE_LIMIT = 0.25
+
+manga_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+chapter_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+# Feeds are kept longer when they can be refreshed incrementally
+feed_cache = TTLCache(CACHE_SIZE, FEED_MAX_AGE or CACHE_TTL)
+
+
+class RateLimiter:
+    """Spaces out calls to `wait` by at least `interval` seconds, across all threads."""
+    __slots__ = ("interval", "next_at", "lock")
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_at = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"RateLimiter(interval={self.interval})"
+
+    def wait(self):
+        with self.lock:
+            now = monotonic()
+            at = max(self.next_at, now)
+            self.next_at = at + self.interval
+        if at > now:
+            sleep(at - now)
+
+
+feed_limiter = RateLimiter(API_RATE_LIMIT)
+
+
+def _new_client():
+    md = MangaDexPy.Client()
+    md.session.request = functools.partial(md.session.request, timeout=10)
+    md.session.headers["User-Agent"] = "Proxymiity/MangaDexZip"
+    md.session.headers.pop("Authorization")
+    return md
+
+
+# Cached objects keep a reference to their client, so they all share this one instead of a client per task
+client = _new_client()
+
+
+def get_manga(manga_id):
+    manga = manga_cache.get(manga_id)
+    if manga is None:
+        manga = client.get_manga(manga_id)
+        manga_cache.set(manga_id, manga)
+    return manga
+
+
+def get_chapter(chapter_id):
+    chapter = chapter_cache.get(chapter_id)
+    if chapter is None:
+        chapter = client.get_chapter(chapter_id)
+        chapter_cache.set(chapter_id, chapter)
+    return chapter
+
+
+def _get_feed_page(manga, params, offset):
+    md = manga.client
+    feed_limiter.wait()
+    req = md.session.get(f"{md.api}/manga/{manga.id}/feed",
+                         params={**params, "limit": FEED_PAGE_SIZE, "offset": offset})
+    if req.status_code == 200:
+        return req.json()
+    elif req.status_code == 204:
+        return None
+    raise MangaDexPy.APIError(req)
+
+
+def fetch_feed(manga, params):
+    """Get all chapters of a manga matching the feed parameters, like `manga.get_chapters`.
+
+    The first page gives the total number of chapters, the other pages are then fetched by up to `feed_concurrency`
+    threads. Requests are still spaced out by the API rate limit, but their round-trips overlap."""
+    params = {**params, "includes[]": MangaDexPy.INCLUDE_ALL}
+    first = _get_feed_page(manga, params, 0)
+    if first is None:
+        raise MangaDexPy.NoResultsError()
+    pages = [first["data"]]
+    offsets = range(FEED_PAGE_SIZE, first["total"], FEED_PAGE_SIZE)
+    if offsets:
+        with ThreadPoolExecutor(max(min(FEED_CONCURRENCY, len(offsets)), 1)) as pool:
+            pages += [p["data"] for p in pool.map(lambda o: _get_feed_page(manga, params, o), offsets) if p]
+    data = [x for p in pages for x in p]
+    if not data:
+        raise MangaDexPy.NoResultsError()
+    return [MangaDexPy.Chapter(x, manga.client) for x in data]
+
+
+def get_feed(manga, params):
+    """Get the chapters of a manga, cached by manga and feed parameters (language, content ratings...).
+
+    Feeds older than `metadata_cache_ttl` are fetched again. If `feed_max_age` is set, only the chapters updated
+    since the last fetch are fetched and merged instead, and the whole feed is fetched again once older than
+    `feed_max_age` (this drops deleted chapters)."""
+    key = dumps([manga.id, params], sort_keys=True)
+    entry = feed_cache.get(key)
+    now = datetime.utcnow()
+    if entry:
+        full_at, fetched_at, chapters = entry
+        if now - fetched_at < timedelta(seconds=CACHE_TTL):
+            return list(chapters)
+        if FEED_MAX_AGE and now - full_at < timedelta(seconds=FEED_MAX_AGE):
+            try:
+                updated = fetch_feed(manga, {**params,
+                                             "updatedAtSince": fetched_at.strftime("%Y-%m-%dT%H:%M:%S")})
+            except MangaDexPy.NoResultsError:
+                updated = []
+            merged = {c.id: c for c in chapters}
+            merged.update({c.id: c for c in updated})
+            chapters = list(merged.values())
+            feed_cache.set(key, (full_at, now, chapters))
+            return list(chapters)
+
+    chapters = fetch_feed(manga, params)
+    feed_cache.set(key, (now, now, chapters))
+    return list(chapters)
+
+
+def _cache_metrics(counter):
+    return lambda: {("manga",): getattr(manga_cache, counter), ("chapter",): getattr(chapter_cache, counter),
+                    ("feed",): getattr(feed_cache, counter)}
+
+
+if config["backend"]["enabled"]:
+    metrics.Counter("mdzip_metadata_cache_hits_total", "MangaDex metadata cache hits, by cache.", ("cache",),
+                    fn=_cache_metrics("hits"))
+    metrics.Counter("mdzip_metadata_cache_misses_total", "MangaDex metadata cache misses, by cache.", ("cache",),
+                    fn=_cache_metrics("misses"))
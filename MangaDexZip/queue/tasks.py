@@ -1,9 +1,15 @@
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from json import dumps
 from .actions import ActionBase, DefaultCleanupAction
 from typing import Union
 
+MAX_SPANS = 2000
+
 
 class TaskScheduler:
+    __slots__ = ("groups", "active_groups", "queued_groups")
     instance = None
 
     def __init__(self, groups=None):
@@ -65,6 +71,7 @@ class TaskScheduler:
 
 
 class TaskGroup:
+    __slots__ = ("uid", "tasks", "active_tasks", "queued_tasks", "parent")
     instances = {}
 
     def __init__(self, uid, tasks=None):
@@ -136,8 +143,34 @@ class TaskGroup:
         return cls(uid)
 
 
+class TaskSpan:
+    """A timed step of a task. `start` and `end` are in seconds since the task was created."""
+    __slots__ = ("name", "detail", "start", "end", "bytes", "retries")
+
+    def __init__(self, name, start, detail=None):
+        self.name: str = name
+        self.detail: Union[str, None] = detail
+        self.start: float = start
+        self.end: Union[float, None] = None
+        self.bytes = 0
+        self.retries = 0
+
+    def __repr__(self):
+        return f"TaskSpan(name={self.name}, detail={self.detail}, start={self.start}, end={self.end})"
+
+    def dump(self):
+        return {"name": self.name, "detail": self.detail, "start": round(self.start, 3),
+                "end": None if self.end is None else round(self.end, 3),
+                "bytes": self.bytes, "retries": self.retries}
+
+
 class Task:
+    __slots__ = ("uid", "kind", "actions", "queued_actions", "cleanup_action",
+                 "started", "completed", "failed", "cancel_event",
+                 "status", "status_override", "result", "created_at", "parent",
+                 "fingerprint", "referenced_at", "spans", "spans_dropped")
     instances = {}
+    fingerprints = {}
 
     def __init__(self, uid, kind=None, actions=None):
         self.uid: str = uid
@@ -150,6 +183,7 @@ class Task:
         self.started = False
         self.completed = False
         self.failed = False
+        self.cancel_event = threading.Event()
 
         self.status: Union[str, None] = None
         self.status_override: Union[str, None] = None
@@ -157,6 +191,12 @@ class Task:
 
         self.created_at: datetime = datetime.utcnow()
 
+        self.fingerprint: Union[str, None] = None
+        self.referenced_at: datetime = self.created_at
+
+        self.spans: list[TaskSpan] = []
+        self.spans_dropped = 0
+
         self.parent: Union[TaskGroup, None] = None
         Task.instances[uid] = self
 
@@ -173,6 +213,37 @@ class Task:
         _q = len(self.queued_actions)
         return round(((_t - _q)/_t)*100)
 
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def elapsed(self):
+        return (datetime.utcnow() - self.created_at).total_seconds()
+
+    def add_span(self, name, detail=None, start=None, end=None):
+        """Record a step of the task, only the first MAX_SPANS steps are kept."""
+        span = TaskSpan(name, self.elapsed() if start is None else start, detail)
+        span.end = end
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.spans_dropped += 1
+        return span
+
+    @contextmanager
+    def span(self, name, detail=None):
+        """Time the wrapped block as a step of the task."""
+        span = self.add_span(name, detail)
+        try:
+            yield span
+        finally:
+            span.end = self.elapsed()
+
+    def cancel(self, status="Task execution cancelled"):
+        self.failed = True
+        self.status_override = status
+        self.cancel_event.set()
+
     def add_action(self, action):
         if action not in self.actions:
             self.actions.append(action)
@@ -194,8 +265,19 @@ class Task:
             return DefaultCleanupAction()
         return self.cleanup_action
 
+    def set_fingerprint(self, fingerprint):
+        """Register the task as the one to re-use for identical requests."""
+        self.fingerprint = fingerprint
+        Task.fingerprints[fingerprint] = self
+
+    def add_reference(self):
+        """Mark the task as re-used by an identical request, completed tasks expire `task_ttl` after their last use."""
+        self.referenced_at = datetime.utcnow()
+
     def delete_task(self):
         Task.instances.pop(self.uid)
+        if self.fingerprint and Task.fingerprints.get(self.fingerprint) is self:
+            Task.fingerprints.pop(self.fingerprint)
         if self.parent:
             self.parent.remove_task(self)
 
@@ -204,3 +286,16 @@ class Task:
         if uid in Task.instances:
             return Task.instances[uid]
         return cls(uid)
+
+    @staticmethod
+    def fingerprint_of(action):
+        """Identify a request by the first action it creates."""
+        return dumps([action.__class__.__name__, action.data, action.dump()], sort_keys=True)
+
+    @classmethod
+    def get_coalesced_task(cls, fingerprint):
+        """Get a task created by an identical request that is still running or completed."""
+        task = Task.fingerprints.get(fingerprint)
+        if task and not task.failed:
+            return task
+        return None
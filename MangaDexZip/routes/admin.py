@@ -1,17 +1,21 @@
 from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 
 from typing import Union, Annotated
+from itertools import islice
+import heapq
 
 from ..queue import client
-from .queue_worker import BackendCompleteTaskSchedulerInfo
+from .queue_worker import BackendCompleteTaskSchedulerInfo, BackendTaskInfo, BackendTaskListItem, TASK_STATES
 
-from ..stats import stats, volatile_stats
+from .. import stats, profiler
 from ..config import config
 
 
 router = APIRouter(tags=["Admin"], include_in_schema=not config["admin"]["hide_from_openapi"])
 AUTH_TOKEN = config["admin"]["auth_token"]
+ADMIN_TASKS_MAX_LIMIT = 1000
 
 
 class Worker(BaseModel):
@@ -25,92 +29,156 @@ class Worker(BaseModel):
     maintenance: bool = False
 
 
+class TaskListItem(BackendTaskListItem):
+    worker: str
+
+
+class TaskList(BaseModel):
+    total: int
+    offset: int
+    limit: int
+    tasks: list[TaskListItem]
+
+
+class CircuitBreakerInfo(BaseModel):
+    state: str
+    failures: int
+    rejected: int
+    retry_in: float
+
+
+class RegisteredWorker(Worker):
+    circuit: Union[CircuitBreakerInfo, None] = None
+
+
 @router.get("/admin/queue", summary="Get all running tasks on cluster",
             responses={
                 403: {"description": "Invalid authorization token"}
             })
-def queue_info(authorization: Annotated[Union[str, None], Header()] = None) -> BackendCompleteTaskSchedulerInfo:
+async def queue_info(spans: bool = False,
+                     authorization: Annotated[Union[str, None], Header()] = None) -> BackendCompleteTaskSchedulerInfo:
     """Get all running tasks on the entire cluster.
 
+    Tasks from all workers are merged in a single normalized snapshot, see `/queue/back/all`.
+    The estimated wait is the highest one among workers. The timing spans of tasks are only included if `spans` is set.
+
     Warning: This endpoint may impact workers' performance when used.
 
     If configured, this endpoint will require an authorization token."""
     if AUTH_TOKEN and authorization != AUTH_TOKEN:
         raise HTTPException(status_code=403, detail="Invalid authorization token")
-    _g, _ag, _qg = {}, {}, {}
-    _t, _at, _qt = {}, {}, {}
-    _a, _qa = [], []
+    _g, _t = {}, {}
+    _ag, _qg = {}, {}
+    _at, _qt = [], []
+    _a, _qa, _wait = 0, 0, 0
     _ready = True
 
-    for k in client.BACKENDS.keys():
-        data = client.get_all(k)
+    # Each worker's snapshot is merged as soon as it arrives, and dropped right after
+    _missing = set(client.BACKENDS.keys())
+    async for k, data in client.fan_out_iter(client.get_all, tuple(_missing), spans):
         if not data:
-            _ready = False
             continue
+        _missing.discard(k)
 
         if not data["ready"]:
             _ready = False
 
+        # Groups are identified by the user's address, so the same group can exist on multiple workers
         for gk, gv in data["groups"].items():
-            _g[gk] = {**_g.get(gk, {}), **gv}
-        for agk, agv in data["active_groups"].items():
-            _ag[agk] = {**_ag.get(agk, {}), **agv}
-        for qgk, qgv in data["queued_groups"].items():
-            _qg[qgk] = {**_qg.get(qgk, {}), **qgv}
-
-        _t = {**_t, **data["tasks"]}
-        _at = {**_at, **data["active_tasks"]}
-        _qt = {**_qt, **data["queued_tasks"]}
+            if gk in _g:
+                for key in ("tasks", "active_tasks", "queued_tasks"):
+                    _g[gk][key].extend(gv[key])
+            else:
+                _g[gk] = gv
+        _ag.update(dict.fromkeys(data["active_groups"]))
+        _qg.update(dict.fromkeys(data["queued_groups"]))
+
+        _t.update(data["tasks"])
+        _at.extend(data["active_tasks"])
+        _qt.extend(data["queued_tasks"])
 
         _a += data["actions"]
         _qa += data["queued_actions"]
-
-    return BackendCompleteTaskSchedulerInfo(
-        ready=_ready,
-        groups=_g,
-        active_groups=_ag,
-        queued_groups=_qg,
-        tasks=_t,
-        active_tasks=_at,
-        queued_tasks=_qt,
-        actions=_a,
-        queued_actions=_qa
-    )
+        _wait = max(_wait, data.get("estimated_wait", 0))
+    if _missing:
+        _ready = False
+
+    return JSONResponse({
+        "ready": _ready,
+        "groups": _g,
+        "active_groups": list(_ag),
+        "queued_groups": list(_qg),
+        "tasks": _t,
+        "active_tasks": _at,
+        "queued_tasks": _qt,
+        "actions": _a,
+        "queued_actions": _qa,
+        "estimated_wait": _wait
+    })
 
 
 @router.get("/admin/queue/all", summary="Get all running tasks on all workers",
             responses={
                 403: {"description": "Invalid authorization token"}
             })
-def queue_info(authorization: Annotated[Union[str, None], Header()] = None) \
+async def queue_info(spans: bool = False,
+                     authorization: Annotated[Union[str, None], Header()] = None) \
         -> dict[str, BackendCompleteTaskSchedulerInfo]:
     """Get all running tasks on all workers.
 
+    The timing spans of tasks are only included if `spans` is set.
+
     Warning: This endpoint may impact workers' performance when used.
 
     If configured, this endpoint will require an authorization token."""
     if AUTH_TOKEN and authorization != AUTH_TOKEN:
         raise HTTPException(status_code=403, detail="Invalid authorization token")
-    _w = {}
+    _all = await client.fan_out(client.get_all, client.BACKENDS.keys(), spans)
+    return JSONResponse({k: data for k, data in _all.items() if data})
+
 
-    for k in client.BACKENDS.keys():
-        data = client.get_all(k)
+@router.get("/admin/queue/tasks", summary="List tasks on cluster",
+            responses={
+                400: {"description": "Unknown task state"},
+                403: {"description": "Invalid authorization token"}
+            })
+async def queue_tasks(state: Union[str, None] = None,
+                      group: Union[str, None] = None,
+                      kind: Union[str, None] = None,
+                      worker: Union[str, None] = None,
+                      offset: int = 0,
+                      limit: int = 100,
+                      authorization: Annotated[Union[str, None], Header()] = None) -> TaskList:
+    """List tasks on the entire cluster, oldest first, without their actions.
+
+    - `state` is optional, and is one of `queued`, `active`, `completed` and `failed`.
+    - `group`, `kind` and `worker` are optional, and only keep tasks of this group, kind or worker.
+    - `offset` and `limit` select the page of tasks to return, `limit` being at most 1000.
+    `total` is the number of matching tasks on the workers that answered.
+
+    Unlike `/admin/queue`, workers only send the tasks needed for the requested page.
+
+    If configured, this endpoint will require an authorization token."""
+    if AUTH_TOKEN and authorization != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid authorization token")
+    if state and state not in TASK_STATES:
+        raise HTTPException(status_code=400, detail="Unknown task state")
+    offset, limit = max(offset, 0), min(max(limit, 0), ADMIN_TASKS_MAX_LIMIT)
+
+    params = {"limit": offset + limit}
+    params.update({k: v for k, v in (("state", state), ("group", group), ("kind", kind)) if v})
+    _total, _lists = 0, []
+    workers = [worker] if worker in client.BACKENDS else [] if worker else client.BACKENDS.keys()
+    async for k, data in client.fan_out_iter(client.get_tasks, workers, params):
         if not data:
             continue
+        _total += data["total"]
+        _lists.append([{**t, "worker": k} for t in data["tasks"]])
 
-        _w[k] = BackendCompleteTaskSchedulerInfo(
-            ready=data["ready"],
-            groups=data["groups"],
-            active_groups=data["active_groups"],
-            queued_groups=data["queued_groups"],
-            tasks=data["tasks"],
-            active_tasks=data["active_tasks"],
-            queued_tasks=data["queued_tasks"],
-            actions=data["actions"],
-            queued_actions=data["queued_actions"]
-        )
-
-    return _w
+    # Every worker sent its oldest matching tasks, so the page is the start of their merge
+    merged = heapq.merge(*_lists, key=lambda t: t["created_at"])
+    return TaskList(total=_total, offset=offset, limit=limit,
+                    tasks=list(islice(merged, offset, offset + limit)))
 
 
 @router.get("/admin/queue/{worker_id}", summary="Get all running tasks on a specific worker",
@@ -119,10 +187,13 @@ def queue_info(authorization: Annotated[Union[str, None], Header()] = None) \
                 404: {"description": "Worker not found"},
                 502: {"description": "Communication error with worker"}
             })
-def queue_info(worker_id: str,
-               authorization: Annotated[Union[str, None], Header()] = None) -> BackendCompleteTaskSchedulerInfo:
+async def queue_info(worker_id: str,
+                     spans: bool = False,
+                     authorization: Annotated[Union[str, None], Header()] = None) -> BackendCompleteTaskSchedulerInfo:
     """Get all running tasks on a specific worker.
 
+    The timing spans of tasks are only included if `spans` is set.
+
     Warning: This endpoint may impact the worker's performance when used.
 
     If configured, this endpoint will require an authorization token."""
@@ -131,21 +202,38 @@ def queue_info(worker_id: str,
     if worker_id not in client.BACKENDS:
         raise HTTPException(status_code=404, detail="Unknown worker")
 
-    data = client.get_all(worker_id)
+    data = await client.get_all(worker_id, spans)
     if not data:
         raise HTTPException(status_code=502, detail="Couldn't reach worker, please try again later")
 
-    return BackendCompleteTaskSchedulerInfo(
-        ready=data["ready"],
-        groups=data["groups"],
-        active_groups=data["active_groups"],
-        queued_groups=data["queued_groups"],
-        tasks=data["tasks"],
-        active_tasks=data["active_tasks"],
-        queued_tasks=data["queued_tasks"],
-        actions=data["actions"],
-        queued_actions=data["queued_actions"]
-    )
+    return JSONResponse(data)
+
+
+@router.get("/admin/task/{task_id}", summary="Get info and timings for a task",
+            responses={
+                403: {"description": "Invalid authorization token"},
+                404: {"description": "Task not found"}
+            })
+async def task_info(task_id: str,
+                    authorization: Annotated[Union[str, None], Header()] = None) -> BackendTaskInfo:
+    """Find a task on a worker, and get its info along with the timing of each of its steps.
+
+    Spans are listed in order, with `start` and `end` in seconds since the task was created:
+    - `queue_wait`: time spent waiting for the first action to start.
+    - One span per action, named after the action.
+    - `manga_info`, `feed`, `chapter_info` and `at_home`: MangaDex API calls.
+    - `pages`: page transfers of a chapter, with the downloaded bytes and retries.
+    - `rate_limit`: time spent waiting between chapters.
+    - `archive`: archiving, with the archive size.
+
+    If configured, this endpoint will require an authorization token."""
+    if AUTH_TOKEN and authorization != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid authorization token")
+    task = await client.get_info(task_id, spans=True)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    return task
 
 
 @router.delete("/admin/task/{task_id}", summary="Immediately cancel a running task",
@@ -154,47 +242,59 @@ def queue_info(worker_id: str,
                    404: {"description": "Task not found"},
                    502: {"description": "Communication error with worker"}
                })
-def queue_cancel(task_id: str,
-                 authorization: Annotated[Union[str, None], Header()] = None):
+async def queue_cancel(task_id: str,
+                       authorization: Annotated[Union[str, None], Header()] = None):
     """Find and cancel a running task on a worker.
 
     If configured, this endpoint will require an authorization token."""
     if AUTH_TOKEN and authorization != AUTH_TOKEN:
         raise HTTPException(status_code=403, detail="Invalid authorization token")
-    task = client.get_info(task_id)
+    task = await client.get_info(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    result = client.mark_failed(task_id)
+    try:
+        result = await client.mark_failed(task_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Task not found")
     if not result:
         raise HTTPException(status_code=502, detail="Couldn't reach worker, please try again later")
 
     return result
 
 
+def _workers():
+    return {k: RegisteredWorker(url=v["url"], external_url=v["external_url"], token=v["token"],
+                                priority=v["priority"], timeout=v["timeout"],
+                                proxy_data=v["proxy_data"], skip_ready_check=v["skip_ready_check"],
+                                maintenance=v["maintenance"],
+                                circuit=client.breakers[k].info() if k in client.breakers else None)
+            for k, v in client.BACKENDS.items()}
+
+
 @router.get("/admin/workers", summary="Get all registered workers",
             responses={
                 403: {"description": "Invalid authorization token"}
             })
-def workers_list(authorization: Annotated[Union[str, None], Header()] = None) -> dict[str, Worker]:
+def workers_list(authorization: Annotated[Union[str, None], Header()] = None) -> dict[str, RegisteredWorker]:
     """Get all registered workers.
 
+    `circuit` is the worker's circuit breaker: `closed` when the worker is up, `open` when requests to the worker
+    fail immediately after repeated failures, and `half_open` while checking whether it came back up.
+
     If configured, this endpoint will require an authorization token."""
     if AUTH_TOKEN and authorization != AUTH_TOKEN:
         raise HTTPException(status_code=403, detail="Invalid authorization token")
-    return {k: Worker(url=v["url"], external_url=v["external_url"], token=v["token"],
-                      priority=v["priority"], timeout=v["timeout"],
-                      proxy_data=v["proxy_data"], skip_ready_check=v["skip_ready_check"],
-                      maintenance=v["maintenance"]) for k, v in client.BACKENDS.items()}
+    return _workers()
 
 
 @router.put("/admin/workers/{worker_id}", summary="Add worker to backends",
             responses={
                 403: {"description": "Invalid authorization token"}
             })
-def workers_add(worker_id: str,
-                worker: Worker,
-                authorization: Annotated[Union[str, None], Header()] = None) -> dict[str, Worker]:
+async def workers_add(worker_id: str,
+                      worker: Worker,
+                      authorization: Annotated[Union[str, None], Header()] = None) -> dict[str, RegisteredWorker]:
     """Add worker to backends.
 
     If configured, this endpoint will require an authorization token."""
@@ -211,11 +311,9 @@ def workers_add(worker_id: str,
         "maintenance": worker.maintenance
     }
     config.save()
+    await client.close_session(worker_id)
 
-    return {k: Worker(url=v["url"], external_url=v["external_url"], token=v["token"],
-                      priority=v["priority"], timeout=v["timeout"],
-                      proxy_data=v["proxy_data"], skip_ready_check=v["skip_ready_check"],
-                      maintenance=v["maintenance"]) for k, v in client.BACKENDS.items()}
+    return _workers()
 
 
 @router.delete("/admin/workers/{worker_id}", summary="Remove worker from backends",
@@ -223,8 +321,8 @@ def workers_add(worker_id: str,
                    403: {"description": "Invalid authorization token"},
                    404: {"description": "Worker not found"}
                })
-def workers_del(worker_id: str,
-                authorization: Annotated[Union[str, None], Header()] = None) -> dict[str, Worker]:
+async def workers_del(worker_id: str,
+                      authorization: Annotated[Union[str, None], Header()] = None) -> dict[str, RegisteredWorker]:
     """Remove worker from backends.
 
     If configured, this endpoint will require an authorization token."""
@@ -234,11 +332,60 @@ def workers_del(worker_id: str,
         raise HTTPException(status_code=404, detail="Unknown worker")
     config["frontend"]["backends"].pop(worker_id)
     config.save()
+    await client.close_session(worker_id)
 
-    return {k: Worker(url=v["url"], external_url=v["external_url"], token=v["token"],
-                      priority=v["priority"], timeout=v["timeout"],
-                      proxy_data=v["proxy_data"], skip_ready_check=v["skip_ready_check"],
-                      maintenance=v["maintenance"]) for k, v in client.BACKENDS.items()}
+    return _workers()
+
+
+@router.get("/admin/profile", summary="Profile this instance",
+            responses={
+                403: {"description": "Invalid authorization token"},
+                409: {"description": "A profile is already running"}
+            },
+            response_class=PlainTextResponse)
+def profile(duration: float = 10,
+            interval: float = 0.01,
+            authorization: Annotated[Union[str, None], Header()] = None) -> PlainTextResponse:
+    """Sample the stacks of all threads of this instance for `duration` seconds (at most 60), every `interval` seconds.
+
+    The response is in the collapsed stack format (one `thread;outer;...;inner count` line per stack), which can be
+    turned into a flamegraph with flamegraph.pl, speedscope or inferno.
+
+    If configured, this endpoint will require an authorization token."""
+    if AUTH_TOKEN and authorization != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid authorization token")
+    try:
+        return PlainTextResponse(profiler.sample(duration, interval))
+    except profiler.ProfilerBusyError:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+
+@router.get("/admin/profile/{worker_id}", summary="Profile a worker",
+            responses={
+                403: {"description": "Invalid authorization token"},
+                404: {"description": "Worker not found"},
+                409: {"description": "A profile is already running"},
+                502: {"description": "Communication error with worker"}
+            },
+            response_class=PlainTextResponse)
+async def profile_worker(worker_id: str,
+                         duration: float = 10,
+                         interval: float = 0.01,
+                         authorization: Annotated[Union[str, None], Header()] = None) -> PlainTextResponse:
+    """Sample the stacks of all threads of a worker, see `/admin/profile`.
+
+    If configured, this endpoint will require an authorization token."""
+    if AUTH_TOKEN and authorization != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid authorization token")
+    if worker_id not in client.BACKENDS:
+        raise HTTPException(status_code=404, detail="Unknown worker")
+
+    result = await client.get_profile(worker_id, duration, interval)
+    if result == 409:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    if not isinstance(result, str):
+        raise HTTPException(status_code=502, detail="Couldn't reach worker, please try again later")
+    return PlainTextResponse(result)
 
 
 @router.get("/admin/stats", summary="Statistics",
@@ -248,4 +395,5 @@ def workers_del(worker_id: str,
 def get_stats(authorization: Annotated[Union[str, None], Header()] = None):
     if AUTH_TOKEN and authorization != AUTH_TOKEN:
         raise HTTPException(status_code=403, detail="Invalid authorization token")
-    return {"all_time": stats, "since_boot": volatile_stats}
+    return {"all_time": stats.stats.copy(), "since_boot": stats.volatile_stats.copy(), **stats.series(),
+            "task_cache": client.task_cache.stats()}
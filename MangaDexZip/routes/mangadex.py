@@ -24,25 +24,25 @@ class NewTask(BaseModel):
 @router.get("/manga/{manga_id}", include_in_schema=False)
 @router.get("/title/{manga_id}/{garbage}", include_in_schema=False)
 @router.get("/manga/{manga_id}/{garbage}", include_in_schema=False)
-def add_manga(manga_id: str,
-              request: Request,
-              garbage: Union[str, None] = None,
-              light: Union[str, None] = None,
-              lang: Union[str, None] = "en",
-              title: Union[str, None] = None,
-              group: Annotated[Union[list[str], None], Query()] = None,
-              group_only: Union[str, None] = None,
-              start: Union[float, None] = None,
-              end: Union[float, None] = None) -> RedirectResponse:
+async def add_manga(manga_id: str,
+                    request: Request,
+                    garbage: Union[str, None] = None,
+                    light: Union[str, None] = None,
+                    lang: Union[str, None] = "en",
+                    title: Union[str, None] = None,
+                    group: Annotated[Union[list[str], None], Query()] = None,
+                    group_only: Union[str, None] = None,
+                    start: Union[float, None] = None,
+                    end: Union[float, None] = None) -> RedirectResponse:
     """Download a Manga.
 
     *front-end use only* - For API usage, please refer to the /api/manga endpoint.
 
     *This endpoint is named '/title' to match MangaDex's frontend paths. It is also aliased to `/manga`.*"""
     _ = garbage
-    task = _add_manga(manga_id, request, light=light, lang=lang, title=title,
-                      group=group, group_only=group_only,
-                      start=start, end=end)
+    task = await _add_manga(manga_id, request, light=light, lang=lang, title=title,
+                            group=group, group_only=group_only,
+                            start=start, end=end)
     stats.add("manga")
 
     api_host = f"{request.url.hostname}:{request.url.port}" if request.url.port else request.url.hostname
@@ -56,15 +56,15 @@ def add_manga(manga_id: str,
                 502: {"description": "Error during worker communication"},
                 503: {"description": "No reachable workers at this time"}
             })
-def add_manga_api(manga_id: str,
-                  request: Request,
-                  light: Union[str, None] = None,
-                  lang: Union[str, None] = "en",
-                  title: Union[str, None] = None,
-                  group: Annotated[Union[list[str], None], Query()] = None,
-                  group_only: Union[str, None] = None,
-                  start: Union[float, None] = None,
-                  end: Union[float, None] = None) -> NewTask:
+async def add_manga_api(manga_id: str,
+                        request: Request,
+                        light: Union[str, None] = None,
+                        lang: Union[str, None] = "en",
+                        title: Union[str, None] = None,
+                        group: Annotated[Union[list[str], None], Query()] = None,
+                        group_only: Union[str, None] = None,
+                        start: Union[float, None] = None,
+                        end: Union[float, None] = None) -> NewTask:
     """Download a Manga.
 
     - `manga_id` must be a valid MangaDex Manga (Title).
@@ -76,26 +76,22 @@ def add_manga_api(manga_id: str,
     If your task finishes successfully, the `redirect_uri` property will correspond to the URL of your task's file.
 
     *developer use only* - For regular usage, please refer to the `/title` endpoint."""
-    task = _add_manga(manga_id, request, light=light, lang=lang, title=title,
-                      group=group, group_only=group_only,
-                      start=start, end=end)
+    task = await _add_manga(manga_id, request, light=light, lang=lang, title=title,
+                            group=group, group_only=group_only,
+                            start=start, end=end)
     stats.add("manga_api")
     return NewTask(task_id=task["task_id"])
 
 
-def _add_manga(manga_id: str,
-               request: Request,
-               light: Union[str, None] = None,
-               lang: Union[str, None] = "en",
-               title: Union[str, None] = None,
-               group: Annotated[Union[list[str], None], Query()] = None,
-               group_only: Union[str, None] = None,
-               start: Union[float, None] = None,
-               end: Union[float, None] = None):
-    worker = client.select_worker_auto()
-    if not worker:
-        raise HTTPException(status_code=503, detail="No reachable workers, please try again later")
-
+async def _add_manga(manga_id: str,
+                     request: Request,
+                     light: Union[str, None] = None,
+                     lang: Union[str, None] = "en",
+                     title: Union[str, None] = None,
+                     group: Annotated[Union[list[str], None], Query()] = None,
+                     group_only: Union[str, None] = None,
+                     start: Union[float, None] = None,
+                     end: Union[float, None] = None):
     opt = {
         "light": True if light in ("1", "true") else False,
         "language": lang or "en",
@@ -105,7 +101,11 @@ def _add_manga(manga_id: str,
         "start": start or None,
         "end": end or None
     }
-    task = client.append(worker, "manga", manga_id, opt, request.client.host)
+    worker = client.select_worker_coalesced("manga", manga_id, opt) or await client.select_worker_auto()
+    if not worker:
+        raise HTTPException(status_code=503, detail="No reachable workers, please try again later")
+
+    task = await client.append(worker, "manga", manga_id, opt, request.client.host)
     if not task:
         raise HTTPException(status_code=502, detail="Couldn't reach worker, please try again later")
     return task
@@ -119,15 +119,15 @@ def _add_manga(manga_id: str,
             },
             response_class=RedirectResponse, status_code=302)
 @router.get("/chapter/{chapter_id}/{garbage}", include_in_schema=False)
-def add_chapter(chapter_id: str,
-                request: Request,
-                garbage: Union[str, None] = None,
-                light: Union[str, None] = None) -> RedirectResponse:
+async def add_chapter(chapter_id: str,
+                      request: Request,
+                      garbage: Union[str, None] = None,
+                      light: Union[str, None] = None) -> RedirectResponse:
     """Download a Chapter.
 
     *front-end use only* - For API usage, please refer to the `/api/chapter` endpoint."""
     _ = garbage
-    task = _add_chapter(chapter_id, request, light=light)
+    task = await _add_chapter(chapter_id, request, light=light)
     stats.add("chapters")
 
     api_host = f"{request.url.hostname}:{request.url.port}" if request.url.port else request.url.hostname
@@ -141,9 +141,9 @@ def add_chapter(chapter_id: str,
                 502: {"description": "Error during worker communication"},
                 503: {"description": "No reachable workers at this time"}
             })
-def add_chapter_api(chapter_id: str,
-                    request: Request,
-                    light: Union[str, None] = None) -> NewTask:
+async def add_chapter_api(chapter_id: str,
+                          request: Request,
+                          light: Union[str, None] = None) -> NewTask:
     """Start a new Download Chapter Task.
 
     - `chapter_id` must be a valid MangaDex Chapter.
@@ -154,22 +154,22 @@ def add_chapter_api(chapter_id: str,
     If your task finishes successfully, the `redirect_uri` property will correspond to the URL of your task's file.
 
     *developer use only* - For regular usage, please refer to the `/chapter` endpoint."""
-    task = _add_chapter(chapter_id, request, light=light)
-    stats.add("chapter_api")
+    task = await _add_chapter(chapter_id, request, light=light)
+    stats.add("chapters_api")
     return NewTask(task_id=task["task_id"])
 
 
-def _add_chapter(chapter_id: str,
-                 request: Request,
-                 light: Union[str, None] = None):
-    worker = client.select_worker_auto()
-    if not worker:
-        raise HTTPException(status_code=503, detail="No reachable workers, please try again later")
-
+async def _add_chapter(chapter_id: str,
+                       request: Request,
+                       light: Union[str, None] = None):
     opt = {
         "light": True if light in ("1", "true") else False
     }
-    task = client.append(worker, "chapter", chapter_id, opt, request.client.host)
+    worker = client.select_worker_coalesced("chapter", chapter_id, opt) or await client.select_worker_auto()
+    if not worker:
+        raise HTTPException(status_code=503, detail="No reachable workers, please try again later")
+
+    task = await client.append(worker, "chapter", chapter_id, opt, request.client.host)
     if not task:
         raise HTTPException(status_code=502, detail="Couldn't reach worker, please try again later")
     return task
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from typing import Union, Annotated
+
+from .. import metrics
+from ..config import config
+
+
+router = APIRouter(include_in_schema=False)
+AUTH_TOKEN = config.get("metrics", {}).get("auth_token")
+
+
+@router.get("/metrics", summary="Prometheus metrics")
+def get_metrics(authorization: Annotated[Union[str, None], Header()] = None) -> PlainTextResponse:
+    """Get metrics in the Prometheus text format.
+
+    If configured, this endpoint will require an authorization token."""
+    if AUTH_TOKEN and authorization != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid authorization token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 
-from requests.exceptions import HTTPError
+from httpx import HTTPError
 
 from typing import Union
 
@@ -11,6 +12,7 @@ from ..queue import client
 
 router = APIRouter(tags=["Queue"])
 templates = Jinja2Templates(directory="MangaDexZip/web")
+BATCH_MAX_TASKS = 100
 
 
 class SystemInfo(BaseModel):
@@ -32,6 +34,10 @@ class TaskGroupInfo(BaseModel):
     active_tasks: int
 
 
+class TaskBatchRequest(BaseModel):
+    task_ids: list[str]
+
+
 class TaskInfo(BaseModel):
     uid: str
     started: bool
@@ -45,14 +51,14 @@ class TaskInfo(BaseModel):
 
 
 @router.get("/queue/front", summary="Get info on running tasks")
-def queue_info() -> SystemInfo:
+async def queue_info() -> SystemInfo:
     """Get general info about running tasks."""
     _workers = 0
     _busy_workers = 0
     _tasks = 0
     _act_tasks = 0
-    for k in client.BACKENDS.keys():
-        q = client.query(k)
+    _queries = await client.fan_out(client.query, client.BACKENDS.keys(), deadline=client.FAN_OUT_DEADLINE)
+    for q in _queries.values():
         if q:
             _workers += 1
             if q["active_tasks"]:
@@ -67,19 +73,62 @@ def queue_info() -> SystemInfo:
     )
 
 
+@router.post("/queue/front/batch", summary="Get info on multiple tasks",
+             responses={
+                 400: {"description": "Too many tasks requested"}
+             })
+async def task_info_batch(batch: TaskBatchRequest,
+                          request: Request) -> dict[str, TaskInfo]:
+    """Get info on multiple running tasks at once.
+
+    Up to 100 task IDs can be requested at once. Tasks that weren't found are left out of the response."""
+    if len(batch.task_ids) > BATCH_MAX_TASKS:
+        raise HTTPException(status_code=400, detail=f"Cannot request more than {BATCH_MAX_TASKS} tasks at once")
+    infos = await client.get_info_batch(list(dict.fromkeys(batch.task_ids)))
+    return {k: _task_info(k, v, request) for k, v in infos.items()}
+
+
 @router.get("/queue/front/{task_id}", summary="Get info on a specific task",
             responses={
                 404: {"description": "Task not found"}
             })
-def task_info(task_id: str,
-              request: Request) -> TaskInfo:
+async def task_info(task_id: str,
+                    request: Request) -> TaskInfo:
     """Get info on a running task."""
-    task = client.get_info(task_id)
+    task = await client.get_info(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    return _task_info(task_id, task, request)
+
+
+@router.get("/queue/front/{task_id}/events", summary="Stream info updates for a specific task",
+            responses={
+                200: {"description": "Server-sent events stream"},
+                404: {"description": "Task not found"}
+            },
+            response_class=StreamingResponse)
+async def task_events(task_id: str,
+                      request: Request) -> StreamingResponse:
+    """Stream info updates for a running task, as server-sent events.
+
+    Each event's data has the same format as the task info endpoint.
+    An event is sent each time the task info changes, and the stream ends once the task is completed or failed."""
+    task = await client.get_info(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    if task["completed"]:
-        worker = client.BACKENDS[client.task_cache[task_id][0]]
+    async def _events():
+        async for info in client.watch(task_id):
+            yield f"data: {_task_info(task_id, info, request).json()}\n\n"
+
+    return StreamingResponse(_events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _task_info(task_id, task, request):
+    worker = client.BACKENDS.get(client.get_owner(task_id))
+    if task["completed"] and worker:
         if worker["proxy_data"]:
             api_host = f"{request.url.hostname}:{request.url.port}" if request.url.port else request.url.hostname
             api_url = f"{request.url.scheme}://{api_host}"
@@ -121,13 +170,13 @@ def task_info(task_id: str,
                 404: {"description": "Task not found"},
             },
             response_class=HTMLResponse)
-def task_wait(task_id: str,
-              request: Request) -> HTMLResponse:
+async def task_wait(task_id: str,
+                    request: Request) -> HTMLResponse:
     """*front-end use only* Wait for a running task.
 
     This page will send a small HTML structure and JS script that regularly refreshes the task's progress.
     The script will then redirect the user to the download link."""
-    task = client.get_info(task_id)
+    task = await client.get_info(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -149,7 +198,7 @@ def task_wait(task_id: str,
                 503: {"description": "Task not supported"}
             },
             response_class=StreamingResponse)
-def task_data(task_id: str):
+async def task_data(task_id: str):
     """Download data for a specific task.
 
     The data can only be retrieved for a completed task that hasn't failed.
@@ -158,18 +207,16 @@ def task_data(task_id: str):
     You should **always** follow the `redirect_uri` present in the task info endpoint.
     Not all tasks are retrievable from this endpoint.
     """
-    task = client.get_info(task_id)
+    task = await client.get_info(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
     try:
-        data = client.proxy_data(task_id)
-        return StreamingResponse(data.iter_content(chunk_size=8192), media_type="application/zip",
-                                 headers={"Content-Disposition": data.headers.get("Content-Disposition"),
-                                          "Content-Type": data.headers.get("Content-Type"),
-                                          "Content-Length": data.headers.get("Content-Length"),
-                                          "Last-Modified": data.headers.get("Last-Modified"),
-                                          "ETag": data.headers.get("ETag")})
+        data = await client.proxy_data(task_id)
+        _headers = {k: data.headers[k] for k in ("Content-Disposition", "Content-Type", "Content-Length",
+                                                 "Content-Encoding", "Last-Modified", "ETag") if k in data.headers}
+        return StreamingResponse(client.iter_data(data), media_type="application/zip", headers=_headers,
+                                 background=BackgroundTask(data.aclose))
     except client.WorkerProxyDisabledError:
         raise HTTPException(status_code=400, detail="Task cannot be retrieved via this endpoint")
     except FileNotFoundError:
@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Header, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response, PlainTextResponse
 from pydantic import BaseModel
 from uuid import uuid4
+import re
 from datetime import datetime
 from json import dumps
+from time import monotonic
+import asyncio
+import heapq
 
 from typing import Union, Annotated
 
 from ..queue import manager, tasks, actions
+from .. import profiler
 
 from ..config import config
 
@@ -16,6 +21,13 @@ router = APIRouter(tags=["Queue Worker"], include_in_schema=not config["backend"
 AUTH_TOKEN = config["backend"]["auth_token"]
 ALWAYS_ALLOW_RETRIEVE = config["backend"]["always_allow_retrieve"]
 ENFORCE_LIMITS = config["backend"]["enforce_limits"]
+EVENTS_INTERVAL = config["backend"].get("events_interval", 1)
+EVENTS_KEEPALIVE = 15
+EVENTS_QUEUE_INTERVAL = 10
+TASK_STATES = ("queued", "active", "completed", "failed")
+SCHEDULER_INFO_TTL = 1
+
+_scheduler_info_cache = {"at": 0, "info": None}
 
 
 class BackendTaskSchedulerInfo(BaseModel):
@@ -27,6 +39,7 @@ class BackendTaskSchedulerInfo(BaseModel):
     queued_tasks: int
     actions: int
     queued_actions: int
+    estimated_wait: float = 0
 
 
 class BackendTaskGroupInfo(BaseModel):
@@ -41,12 +54,26 @@ class BackendTaskRequest(BaseModel):
     data: str
     opt_data: Union[dict, None] = {}
     group: str
+    prefix: Union[str, None] = None
 
 
 class BackendTaskResponse(BaseModel):
     task_id: str
 
 
+class BackendTaskBatchRequest(BaseModel):
+    task_ids: list[str]
+
+
+class BackendTaskSpan(BaseModel):
+    name: str
+    detail: Union[str, None]
+    start: float
+    end: Union[float, None]
+    bytes: int
+    retries: int
+
+
 class BackendTaskInfo(BaseModel):
     uid: str
     kind: Union[str, None]
@@ -61,6 +88,8 @@ class BackendTaskInfo(BaseModel):
     created_at: datetime
     group: Union[BackendTaskGroupInfo, None]
     scheduler: Union[BackendTaskSchedulerInfo, None]
+    spans: Union[list[BackendTaskSpan], None] = None
+    spans_dropped: int = 0
 
 
 class BackendCompleteActionInfo(BaseModel):
@@ -70,36 +99,49 @@ class BackendCompleteActionInfo(BaseModel):
 
 
 class BackendCompleteTaskInfo(BackendTaskInfo):
-    actions: list[Union[BackendCompleteActionInfo, dict]]
-    queued_actions: list[Union[BackendCompleteActionInfo, dict]]
+    actions: list[BackendCompleteActionInfo]
+    queued_actions: list[int]
     status_real: Union[str, None]
     status_override: Union[str, None]
 
 
 class BackendCompleteTaskGroupInfo(BackendTaskGroupInfo):
-    tasks: dict[str, Union[BackendCompleteTaskInfo, dict]]
-    active_tasks: dict[str, Union[BackendCompleteTaskInfo, dict]]
-    queued_tasks: dict[str, Union[BackendCompleteTaskInfo, dict]]
+    tasks: list[str]
+    active_tasks: list[str]
+    queued_tasks: list[str]
 
 
 class BackendCompleteTaskSchedulerInfo(BackendTaskSchedulerInfo):
     ready: bool
-    groups: dict[str, Union[BackendCompleteTaskGroupInfo, dict]]
-    active_groups: dict[str, Union[BackendCompleteTaskGroupInfo, dict]]
-    queued_groups: dict[str, Union[BackendCompleteTaskGroupInfo, dict]]
-    tasks: dict[str, Union[BackendCompleteTaskInfo, dict]]
-    active_tasks: dict[str, Union[BackendCompleteTaskInfo, dict]]
-    queued_tasks: dict[str, Union[BackendCompleteTaskInfo, dict]]
-    actions: list[Union[BackendCompleteActionInfo, dict]]
-    queued_actions: list[Union[BackendCompleteActionInfo, dict]]
+    groups: dict[str, BackendCompleteTaskGroupInfo]
+    active_groups: list[str]
+    queued_groups: list[str]
+    tasks: dict[str, BackendCompleteTaskInfo]
+    active_tasks: list[str]
+    queued_tasks: list[str]
 
 
-def _is_json_serializable(o):
-    try:
-        dumps(o)
-        return True
-    except (TypeError, OverflowError):
-        return False
+class BackendTaskListItem(BaseModel):
+    uid: str
+    group: Union[str, None]
+    kind: Union[str, None]
+    state: str
+    status: Union[str, None]
+    progress: int
+    actions: int
+    queued_actions: int
+    created_at: datetime
+
+
+class BackendTaskList(BaseModel):
+    total: int
+    tasks: list[BackendTaskListItem]
+
+
+def _new_task_uid(new_task):
+    if new_task.prefix and re.fullmatch(r"[\w-]+", new_task.prefix):
+        return f"{new_task.prefix}.{uuid4()}"
+    return str(uuid4())
 
 
 @router.get("/queue/back", summary="Get general backend info",
@@ -113,17 +155,7 @@ def queue_info(authorization: Annotated[Union[str, None], Header()] = None) -> B
     If configured, this endpoint will require an authorization token."""
     if AUTH_TOKEN and authorization != AUTH_TOKEN:
         raise HTTPException(status_code=403, detail="Invalid authorization token")
-    scheduler = manager.scheduler
-    return BackendTaskSchedulerInfo(
-        groups=len(scheduler.groups),
-        active_groups=len(scheduler.active_groups),
-        queued_groups=len(scheduler.queued_groups),
-        tasks=sum([len(g.tasks) for g in scheduler.groups]),
-        active_tasks=sum([len(g.active_tasks) for g in scheduler.active_groups]),
-        queued_tasks=sum([len(g.queued_tasks) for g in scheduler.active_groups]),
-        actions=sum([sum([len(t.actions) for t in g.tasks]) for g in scheduler.groups]),
-        queued_actions=sum([sum([len(t.queued_actions) for t in g.active_tasks]) for g in scheduler.active_groups])
-    )
+    return _scheduler_info()
 
 
 @router.get("/queue/back/ready", summary="Get backend ready status",
@@ -144,92 +176,86 @@ def queue_ready(authorization: Annotated[Union[str, None], Header()] = None) ->
             responses={
                 403: {"description": "Invalid authorization token"}
             })
-def queue_info(authorization: Annotated[Union[str, None], Header()] = None) -> BackendCompleteTaskSchedulerInfo:
+def queue_info(spans: bool = False,
+               authorization: Annotated[Union[str, None], Header()] = None) -> BackendCompleteTaskSchedulerInfo:
     """Get all registered tasks on this worker.
 
+    The response is normalized: each task (with its actions) is only listed once in `tasks`, groups and task states
+    refer to tasks by ID, and `queued_actions` of a task are indexes in its `actions`.
+    `actions` and `queued_actions` of the scheduler are the total number of actions.
+    The timing spans of tasks are only included if `spans` is set.
+
     Warning: This endpoint may impact performance when used.
 
     This endpoint is used for internal communication between the admin and the queue_worker.
     If configured, this endpoint will require an authorization token."""
     if AUTH_TOKEN and authorization != AUTH_TOKEN:
         raise HTTPException(status_code=403, detail="Invalid authorization token")
-    _g, _ag, _qg = {}, {}, {}
-    _t, _at, _qt = {}, {}, {}
-    _a, _qa = [], []
-    scheduler = manager.scheduler
-    for g in scheduler.groups:
-        g_tasks = {}
-        g_active_tasks = {}
-        g_queued_tasks = {}
-
-        for t in g.tasks:
-            t_actions = []
-            t_queued_actions = []
-
-            for a in t.actions:
-                a_info_serializable = [k for k, v in a.__dict__.items() if _is_json_serializable(v)]
-                a_info = BackendCompleteActionInfo(
-                    name=a.__class__.__name__,
-                    data={k: v for k, v in a.__dict__.items() if k in a_info_serializable},
-                    unserializable_data={k: str(v) for k, v in a.__dict__.items() if k not in a_info_serializable}
-                )
-
-                t_actions.append(a_info)
-                _a.append(a_info)
-                if a in t.queued_actions:
-                    t_queued_actions.append(a_info)
-                    _qa.append(a_info)
-
-            t_info = BackendCompleteTaskInfo(
-                uid=t.uid,
-                kind=t.kind,
-                actions=t_actions,
-                queued_actions=t_queued_actions,
-                started=t.started,
-                completed=t.completed,
-                failed=t.failed,
-                status=t.status_override or t.status,
-                status_real=t.status,
-                status_override=t.status_override,
-                result=t.result,
-                progress=t.progress,
-                created_at=t.created_at,
-                group=None,
-                scheduler=None
-            )
-
-            g_tasks[t.uid] = t_info
-            _t[t.uid] = t_info
-            if t in g.active_tasks:
-                g_active_tasks[t.uid] = t_info
-                _at[t.uid] = t_info
-            if t in g.queued_tasks:
-                g_queued_tasks[t.uid] = t_info
-                _qt[t.uid] = t_info
-
-        g_info = BackendCompleteTaskGroupInfo(
-            uid=g.uid,
-            tasks=g_tasks,
-            queued_tasks=g_queued_tasks,
-            active_tasks=g_active_tasks
-        )
-
-        _g[g.uid] = g_info
-        if g in scheduler.active_groups:
-            _ag[g.uid] = g_info
-        if g in scheduler.queued_groups:
-            _qg[g.uid] = g_info
-
-    return BackendCompleteTaskSchedulerInfo(
-        ready=manager.check_status(),
-        groups=_g,
-        active_groups=_ag,
-        queued_groups=_qg,
-        tasks=_t,
-        active_tasks=_at,
-        queued_tasks=_qt,
-        actions=_a,
-        queued_actions=_qa
+    # Plain dicts encoded once, building and validating pydantic models for every action is too slow here
+    return Response(content=dumps(_snapshot(spans), default=str, check_circular=False), media_type="application/json")
+
+
+@router.get("/queue/back/profile", summary="Profile the worker",
+            responses={
+                403: {"description": "Invalid authorization token"},
+                409: {"description": "A profile is already running"}
+            },
+            response_class=PlainTextResponse)
+def queue_profile(duration: float = 10,
+                  interval: float = 0.01,
+                  authorization: Annotated[Union[str, None], Header()] = None) -> PlainTextResponse:
+    """Sample the stacks of all threads of the worker for `duration` seconds (at most 60), every `interval` seconds.
+
+    The response is in the collapsed stack format, ready to be turned into a flamegraph.
+
+    This endpoint is used for internal communication between the admin and the queue_worker.
+    If configured, this endpoint will require an authorization token."""
+    if AUTH_TOKEN and authorization != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid authorization token")
+    try:
+        return PlainTextResponse(profiler.sample(duration, interval))
+    except profiler.ProfilerBusyError:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+
+@router.get("/queue/back/tasks", summary="List existing tasks",
+            responses={
+                400: {"description": "Unknown task state"},
+                403: {"description": "Invalid authorization token"}
+            })
+def queue_tasks(state: Union[str, None] = None,
+                group: Union[str, None] = None,
+                kind: Union[str, None] = None,
+                limit: int = 100,
+                authorization: Annotated[Union[str, None], Header()] = None) -> BackendTaskList:
+    """List the oldest tasks on this worker matching the given filters, without their actions.
+
+    - `state` is optional, and is one of `queued`, `active`, `completed` and `failed`.
+    - `group` and `kind` are optional, and only keep tasks of this group or kind.
+    - `limit` is the maximum number of tasks to return. `total` is the number of matching tasks.
+
+    This endpoint is used for internal communication between the admin and the queue_worker.
+    If configured, this endpoint will require an authorization token."""
+    if AUTH_TOKEN and authorization != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid authorization token")
+    if state and state not in TASK_STATES:
+        raise HTTPException(status_code=400, detail="Unknown task state")
+
+    _tasks = [t for g in manager.scheduler.groups.copy() if not group or g.uid == group
+              for t in g.tasks.copy() if (not kind or t.kind == kind) and (not state or _task_state(t) == state)]
+    return BackendTaskList(
+        total=len(_tasks),
+        tasks=[BackendTaskListItem(
+            uid=t.uid,
+            group=t.parent.uid if t.parent else None,
+            kind=t.kind,
+            state=_task_state(t),
+            status=t.status_override or t.status,
+            progress=t.progress,
+            actions=len(t.actions),
+            queued_actions=len(t.queued_actions),
+            created_at=t.created_at
+        ) for t in heapq.nsmallest(max(limit, 0), _tasks, key=lambda t: t.created_at)]
     )
 
 
@@ -249,40 +275,68 @@ def queue_append(new_task: BackendTaskRequest,
 
     `group` specifies the TaskGroup's uid used for queue fairness.
 
+    `prefix` is optional, and is prepended to the task ID so the frontend can route requests for this task.
+    It is ignored if it contains anything other than letters, digits, underscores and hyphens.
+
+    If an identical task is already running or completed, its ID is returned instead of creating a new task.
+
     This endpoint is used for internal communication between the queue_client and the queue_worker.
     If configured, this endpoint will require an authorization token."""
     if AUTH_TOKEN and authorization != AUTH_TOKEN:
         raise HTTPException(status_code=403, detail="Invalid authorization token")
-    if ENFORCE_LIMITS and not manager.check_status():
-        raise HTTPException(status_code=503, detail="Worker status degraded")
     if new_task.type == "manga":
-        task = tasks.Task.get_task(str(uuid4()))
-        task.kind = "download_archive"
-        task.add_action(actions.AddMangaChapters(new_task.data,
-                                                 light=new_task.opt_data.get("light", False),
-                                                 language=new_task.opt_data.get("language", "en"),
-                                                 append_titles=new_task.opt_data.get("append_titles", False),
-                                                 preferred_groups=new_task.opt_data.get("preferred_groups", []),
-                                                 groups_substitute=new_task.opt_data.get("groups_substitute", True),
-                                                 start=new_task.opt_data.get("start", None),
-                                                 end=new_task.opt_data.get("end", None)))
-        group = tasks.TaskGroup.get_group(new_task.group)
-        group.add_task(task)
-        manager.scheduler.add_group(group)
-        return BackendTaskResponse(task_id=task.uid)
+        action = actions.AddMangaChapters(new_task.data,
+                                          light=new_task.opt_data.get("light", False),
+                                          language=new_task.opt_data.get("language", "en"),
+                                          append_titles=new_task.opt_data.get("append_titles", False),
+                                          preferred_groups=new_task.opt_data.get("preferred_groups", []),
+                                          groups_substitute=new_task.opt_data.get("groups_substitute", True),
+                                          start=new_task.opt_data.get("start", None),
+                                          end=new_task.opt_data.get("end", None))
     elif new_task.type == "chapter":
-        task = tasks.Task.get_task(str(uuid4()))
-        task.kind = "download_archive"
-        task.add_action(actions.DownloadChapter(new_task.data,
-                                                light=new_task.opt_data.get("light", False)))
-        task.add_action(actions.ArchiveContentsZIP())
-        group = tasks.TaskGroup.get_group(new_task.group)
-        group.add_task(task)
-        manager.scheduler.add_group(group)
-        return BackendTaskResponse(task_id=task.uid)
+        action = actions.DownloadChapter(new_task.data,
+                                         light=new_task.opt_data.get("light", False))
     else:
         raise HTTPException(status_code=400, detail="Unsupported task type")
 
+    fingerprint = tasks.Task.fingerprint_of(action)
+    task = tasks.Task.get_coalesced_task(fingerprint)
+    if task:
+        task.add_reference()
+        manager.journal.update_task(task)
+        return BackendTaskResponse(task_id=task.uid)
+
+    if ENFORCE_LIMITS and not manager.check_status():
+        raise HTTPException(status_code=503, detail="Worker status degraded")
+    task = tasks.Task.get_task(_new_task_uid(new_task))
+    task.kind = "download_archive"
+    task.add_action(action)
+    if new_task.type == "chapter":
+        task.add_action(actions.ArchiveContentsZIP())
+    task.set_fingerprint(fingerprint)
+    group = tasks.TaskGroup.get_group(new_task.group)
+    group.add_task(task)
+    manager.scheduler.add_group(group)
+    manager.journal.save_task(task)
+    return BackendTaskResponse(task_id=task.uid)
+
+
+@router.post("/queue/back/batch", summary="Get info for multiple tasks",
+             responses={
+                 403: {"description": "Invalid authorization token"}
+             })
+def task_info_batch(batch: BackendTaskBatchRequest,
+                    authorization: Annotated[Union[str, None], Header()] = None) -> dict[str, BackendTaskInfo]:
+    """Get info for multiple tasks in the queue at once.
+
+    Tasks that aren't known by this worker are left out of the response.
+
+    This endpoint is used for internal communication between the queue_client and the queue_worker.
+    If configured, this endpoint will require an authorization token."""
+    if AUTH_TOKEN and authorization != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid authorization token")
+    return {k: _task_info(tasks.Task.instances[k]) for k in batch.task_ids if k in tasks.Task.instances}
+
 
 @router.get("/queue/back/{task_id}", summary="Get info for a specific task",
             responses={
@@ -290,9 +344,13 @@ def queue_append(new_task: BackendTaskRequest,
                 404: {"description": "Task not found"}
             })
 def task_info(task_id: str,
+              spans: bool = False,
               authorization: Annotated[Union[str, None], Header()] = None) -> BackendTaskInfo:
     """Get info for a specific task in the queue.
 
+    If `spans` is set, the timing of each step of the task (queue wait, actions, MangaDex API calls, page transfers,
+    rate limiting and archiving) is included. `start` and `end` are in seconds since the task was created.
+
     This endpoint is used for internal communication between the queue_client and the queue_worker.
     If configured, this endpoint will require an authorization token."""
     if AUTH_TOKEN and authorization != AUTH_TOKEN:
@@ -300,8 +358,65 @@ def task_info(task_id: str,
     if task_id not in tasks.Task.instances:
         raise HTTPException(status_code=404, detail="Task not found")
 
+    return _task_info(tasks.Task.get_task(uid=task_id), spans=spans)
+
+
+@router.get("/queue/back/{task_id}/events", summary="Stream info updates for a specific task",
+            responses={
+                200: {"description": "Server-sent events stream"},
+                403: {"description": "Invalid authorization token"},
+                404: {"description": "Task not found"}
+            },
+            response_class=StreamingResponse)
+async def task_events(task_id: str,
+                      authorization: Annotated[Union[str, None], Header()] = None) -> StreamingResponse:
+    """Stream info updates for a specific task in the queue, as server-sent events.
+
+    An event is sent each time the task info changes, and the stream ends once the task is completed or failed.
+
+    This endpoint is used for internal communication between the queue_client and the queue_worker.
+    If configured, this endpoint will require an authorization token."""
+    if AUTH_TOKEN and authorization != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid authorization token")
+    if task_id not in tasks.Task.instances:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    return StreamingResponse(_task_events(task_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _task_event_key(task):
+    return (task.status_override or task.status, task.progress, task.started, task.completed, task.failed,
+            task.result, len(task.actions), len(task.queued_actions))
+
+
+async def _task_events(task_id):
+    last_key, last_info = None, None
+    last_sent = last_checked = monotonic()
+    while task_id in tasks.Task.instances:
+        task = tasks.Task.instances[task_id]
+        key = _task_event_key(task)
+        # Group and scheduler counters change with every other task, they are only checked every EVENTS_QUEUE_INTERVAL
+        if key != last_key or monotonic() - last_checked > EVENTS_QUEUE_INTERVAL:
+            info = _task_info(task).json()
+            if info != last_info:
+                yield f"data: {info}\n\n"
+                last_sent = monotonic()
+            last_key, last_info, last_checked = key, info, monotonic()
+        elif monotonic() - last_sent > EVENTS_KEEPALIVE:
+            yield ": keep-alive\n\n"
+            last_sent = monotonic()
+        if task.completed or task.failed:
+            break
+        await asyncio.sleep(EVENTS_INTERVAL)
+
+
+def _scheduler_info():
+    # Shared by all task info requests, the sums are only recomputed once per SCHEDULER_INFO_TTL
+    if _scheduler_info_cache["info"] and monotonic() - _scheduler_info_cache["at"] < SCHEDULER_INFO_TTL:
+        return _scheduler_info_cache["info"]
     scheduler = manager.scheduler
-    _s_info = BackendTaskSchedulerInfo(
+    _scheduler_info_cache["info"] = BackendTaskSchedulerInfo(
         groups=len(scheduler.groups),
         active_groups=len(scheduler.active_groups),
         queued_groups=len(scheduler.queued_groups),
@@ -309,10 +424,80 @@ def task_info(task_id: str,
         active_tasks=sum([len(g.active_tasks) for g in scheduler.active_groups]),
         queued_tasks=sum([len(g.queued_tasks) for g in scheduler.active_groups]),
         actions=sum([sum([len(t.actions) for t in g.tasks]) for g in scheduler.groups]),
-        queued_actions=sum([sum([len(t.queued_actions) for t in g.active_tasks]) for g in scheduler.active_groups])
+        queued_actions=sum([sum([len(t.queued_actions) for t in g.active_tasks]) for g in scheduler.active_groups]),
+        estimated_wait=manager.estimate_wait()
     )
+    _scheduler_info_cache["at"] = monotonic()
+    return _scheduler_info_cache["info"]
 
-    task = tasks.Task.get_task(uid=task_id)
+
+def _snapshot(spans=False):
+    scheduler = manager.scheduler
+    _groups, _tasks = {}, {}
+    _active_tasks, _queued_tasks = [], []
+    _actions = _queued_actions = 0
+    for g in scheduler.groups.copy():
+        g_tasks = g.tasks.copy()
+        g_active = {id(t) for t in g.active_tasks.copy()}
+        g_queued = {id(t) for t in g.queued_tasks.copy()}
+        for t in g_tasks:
+            t_actions = t.actions.copy()
+            t_queued = {id(a) for a in t.queued_actions.copy()}
+            _tasks[t.uid] = {
+                "uid": t.uid,
+                "kind": t.kind,
+                "actions": [a.snapshot() for a in t_actions],
+                "queued_actions": [i for i, a in enumerate(t_actions) if id(a) in t_queued],
+                "started": t.started,
+                "completed": t.completed,
+                "failed": t.failed,
+                "status": t.status_override or t.status,
+                "status_real": t.status,
+                "status_override": t.status_override,
+                "result": t.result,
+                "progress": t.progress,
+                "created_at": t.created_at.isoformat(),
+                "group": None,
+                "scheduler": None,
+                "spans": [x.dump() for x in t.spans.copy()] if spans else None,
+                "spans_dropped": t.spans_dropped
+            }
+            _actions += len(t_actions)
+            _queued_actions += len(t_queued)
+        _groups[g.uid] = {
+            "uid": g.uid,
+            "tasks": [t.uid for t in g_tasks],
+            "active_tasks": [t.uid for t in g_tasks if id(t) in g_active],
+            "queued_tasks": [t.uid for t in g_tasks if id(t) in g_queued]
+        }
+        _active_tasks += _groups[g.uid]["active_tasks"]
+        _queued_tasks += _groups[g.uid]["queued_tasks"]
+
+    return {
+        "ready": manager.check_status(),
+        "groups": _groups,
+        "active_groups": [g.uid for g in scheduler.active_groups.copy()],
+        "queued_groups": [g.uid for g in scheduler.queued_groups.copy()],
+        "tasks": _tasks,
+        "active_tasks": _active_tasks,
+        "queued_tasks": _queued_tasks,
+        "actions": _actions,
+        "queued_actions": _queued_actions,
+        "estimated_wait": manager.estimate_wait()
+    }
+
+
+def _task_state(task):
+    if task.failed:
+        return "failed"
+    if task.completed:
+        return "completed"
+    if task.started:
+        return "active"
+    return "queued"
+
+
+def _task_info(task, spans=False):
     _g_info = BackendTaskGroupInfo(
         uid=task.parent.uid,
         tasks=len(task.parent.tasks),
@@ -333,7 +518,9 @@ def task_info(task_id: str,
         progress=task.progress,
         created_at=task.created_at,
         group=_g_info,
-        scheduler=_s_info
+        scheduler=_scheduler_info(),
+        spans=[x.dump() for x in task.spans.copy()] if spans else None,
+        spans_dropped=task.spans_dropped
     )
 
 
@@ -354,8 +541,9 @@ def task_info(task_id: str,
         raise HTTPException(status_code=404, detail="Task not found")
 
     task = tasks.Task.get_task(uid=task_id)
-    task.failed = True
-    task.status_override = "Task execution cancelled"
+    task.cancel()
+    task.get_cleanup_action().run(task)
+    manager.journal.update_task(task)
 
     return True
 
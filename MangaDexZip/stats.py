@@ -1,5 +1,18 @@
+import threading
+import json
+from os import replace
+from collections import OrderedDict
+from datetime import datetime
+from time import sleep, time
+
 from pxyTools import JSONDict
 
+from .config import config
+
+FLUSH_INTERVAL = config["frontend"].get("stats_flush_interval", 60)
+MINUTE_BUCKETS = 60
+HOUR_BUCKETS = 48
+
 stats = JSONDict("stats.json")
 volatile_stats = {
     "manga": 0,
@@ -7,11 +20,62 @@ volatile_stats = {
     "chapters": 0,
     "chapters_api": 0
 }
+minutes = OrderedDict()
+hours = OrderedDict()
 
 if not stats:
     stats.update(**volatile_stats)
 
+_lock = threading.Lock()
+_dirty = False
+
+
+def _bucket(buckets, start, size):
+    b = buckets.get(start)
+    if b is None:
+        b = buckets[start] = dict.fromkeys(volatile_stats, 0)
+        while len(buckets) > size:
+            buckets.popitem(last=False)
+    return b
+
 
 def add(stat, n=1):
-    stats[stat] += n
-    volatile_stats[stat] += n
+    global _dirty
+    now = int(time())
+    with _lock:
+        stats[stat] = stats.get(stat, 0) + n
+        volatile_stats[stat] += n
+        _bucket(minutes, now - now % 60, MINUTE_BUCKETS)[stat] += n
+        _bucket(hours, now - now % 3600, HOUR_BUCKETS)[stat] += n
+        _dirty = True
+
+
+def series():
+    """Get the per-minute (last hour) and per-hour (last 2 days) counters since boot, keyed by bucket start time."""
+    with _lock:
+        return {"per_minute": {datetime.utcfromtimestamp(k).isoformat(): v.copy() for k, v in minutes.items()},
+                "per_hour": {datetime.utcfromtimestamp(k).isoformat(): v.copy() for k, v in hours.items()}}
+
+
+def save():
+    """Write all-time stats to a temporary file, then replace the stats file with it.
+
+    The stats file is never left half-written, even if the process is killed while saving."""
+    global _dirty
+    with _lock:
+        data = json.dumps(stats, indent=4, separators=(',', ': '))
+        _dirty = False
+    tmp = stats.path.with_name(f"{stats.path.name}.tmp")
+    with open(tmp, encoding=stats.encoding, mode="w") as f:
+        f.write(data)
+    replace(tmp, stats.path)
+
+
+def _flush_loop():
+    while True:
+        sleep(FLUSH_INTERVAL)
+        if _dirty:
+            save()
+
+
+flush_thread = threading.Thread(target=_flush_loop, daemon=True)